@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import os
+from uuid import uuid4
+import orjson
+from fastapi import HTTPException
+import http
+from app.delivery import delivery_queue, WEBHOOK_DEDUP_SIZE, WEBHOOK_DEDUP_TTL, WEBHOOK_QUEUE_SIZE
+from bot.utils.cache import TTLCache
+
+# combined: one process serves webhooks and runs the bot (the default, needs a single web worker)
+# ingress: stateless web workers that only publish jobs to the broker and never import the bot
+# gateway: the single process (see RedisBroker.lock_gateway) that consumes the broker and runs every shard
+PROCESS_MODE = os.getenv('PROCESS_MODE', 'combined')
+BROKER_URL = os.getenv('BROKER_URL', 'redis://localhost:6379/0')
+BROKER_QUEUE = os.getenv('BROKER_QUEUE', 'collabybot:jobs')
+BROKER_QUEUE_SIZE = int(os.getenv('BROKER_QUEUE_SIZE', WEBHOOK_QUEUE_SIZE * 10))
+GATEWAY_LOCK_TTL = int(os.getenv('GATEWAY_LOCK_TTL', 30))
+
+# extends the gateway lock if this process still holds it, or takes it back if it expired and nobody else took
+# it. Comparing and extending in one script keeps the key from changing hands in between
+RENEW_GATEWAY_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBroker:
+    """
+    Broker for combined mode, where jobs are delivered by the same process.
+
+    Jobs go straight onto the delivery queue and delivery ids are deduplicated
+    with an in-memory cache that is kept in the state store across restarts.
+
+    Methods
+    --------
+    publish(job): bool
+        Hand a job to the delivery queue.
+
+    claim(delivery): bool
+        Record a delivery id, unless it was seen recently.
+
+    release(delivery):
+        Forget a delivery id.
+
+    stats(): dict
+        Get the broker's counters.
+    """
+
+    def __init__(self):
+        # imported here so ingress workers never open the state store
+        from bot.utils.state_store import state_store
+
+        # X-GitHub-Delivery ids of recently accepted webhooks, used to drop redeliveries
+        self.recent_deliveries = TTLCache(WEBHOOK_DEDUP_SIZE, WEBHOOK_DEDUP_TTL, state_store, 'deliveries')
+
+    async def publish(self, job) -> bool:
+        """
+        Hand a job to the delivery queue.
+
+        :param dict job: The job to deliver.
+        :return bool: False if the queue is full and the job was dropped.
+        """
+
+        return delivery_queue.put(job)
+
+    async def claim(self, delivery: str) -> bool:
+        """
+        Record a webhook's X-GitHub-Delivery id.
+
+        :param str delivery: The delivery id.
+        :return bool: False if the id was seen recently, meaning this is a redelivery.
+        """
+
+        return self.recent_deliveries.add(delivery)
+
+    async def release(self, delivery: str):
+        """
+        Forget a delivery id, so a retry of the delivery is accepted.
+
+        :param str delivery: The delivery id.
+        :return: None
+        """
+
+        self.recent_deliveries.pop(delivery)
+
+    def stats(self) -> dict:
+        """
+        Get the broker's counters.
+
+        :return dict: The mode and the dedup cache's counters.
+        """
+
+        return {'mode': PROCESS_MODE, 'deliveries': self.recent_deliveries.stats()}
+
+
+class RedisBroker:
+    """
+    Broker for split mode, backed by a Redis list shared by every process.
+
+    Ingress workers push jobs onto the list with publish(), and the gateway
+    moves them onto its delivery queue with consume(). Delivery ids are claimed
+    with SET NX EX, so a redelivery is dropped whichever worker receives it, and
+    the ids expire on their own after WEBHOOK_DEDUP_TTL seconds.
+
+    Methods
+    --------
+    publish(job): bool
+        Push a job onto the shared queue.
+
+    claim(delivery): bool
+        Record a delivery id, unless it was seen recently.
+
+    release(delivery):
+        Forget a delivery id.
+
+    consume():
+        Move jobs from the shared queue to the local delivery queue, forever.
+
+    lock_gateway():
+        Wait until no other gateway process is running, then keep it that way.
+
+    stats(): dict
+        Get the broker's counters.
+    """
+
+    def __init__(self, url: str = BROKER_URL, queue: str = BROKER_QUEUE, maxsize: int = BROKER_QUEUE_SIZE):
+        import redis.asyncio as redis
+
+        self.queue = queue
+        self.maxsize = maxsize
+        self._redis = redis.from_url(url)
+        self.published = 0
+        self.rejected = 0
+        self.consumed = 0
+        self.duplicates = 0
+
+    async def publish(self, job) -> bool:
+        """
+        Push a job onto the shared queue.
+
+        :param dict job: The job to deliver. It must be JSON-serializable.
+        :return bool: False if the shared queue is full and the job was dropped.
+        """
+
+        if await self._redis.llen(self.queue) >= self.maxsize:
+            self.rejected += 1
+            return False
+        await self._redis.lpush(self.queue, orjson.dumps(job))
+        self.published += 1
+        return True
+
+    async def claim(self, delivery: str) -> bool:
+        """
+        Record a webhook's X-GitHub-Delivery id.
+
+        :param str delivery: The delivery id.
+        :return bool: False if the id was seen recently, meaning this is a redelivery.
+        """
+
+        claimed = await self._redis.set(f'{self.queue}:delivery:{delivery}', 1, nx=True, ex=int(WEBHOOK_DEDUP_TTL))
+        if not claimed:
+            self.duplicates += 1
+        return bool(claimed)
+
+    async def release(self, delivery: str):
+        """
+        Forget a delivery id, so a retry of the delivery is accepted.
+
+        :param str delivery: The delivery id.
+        :return: None
+        """
+
+        await self._redis.delete(f'{self.queue}:delivery:{delivery}')
+
+    async def consume(self):
+        """
+        Move jobs from the shared queue to the local delivery queue.
+
+        Waits for room in the delivery queue before taking the next job, so a
+        backlog stays in Redis instead of in the gateway's memory.
+
+        :return: None
+        """
+
+        while True:
+            try:
+                item = await self._redis.brpop(self.queue, timeout=5)
+            except Exception:
+                logger.exception('Failed to read from broker queue %s', self.queue)
+                await asyncio.sleep(1)
+                continue
+            if item is None:
+                continue
+            await delivery_queue.put_wait(orjson.loads(item[1]))
+            self.consumed += 1
+
+    async def lock_gateway(self):
+        """
+        Wait until no other gateway process is running, then keep it that way.
+
+        There can only be one gateway: it keeps the subscriptions and tokens in
+        memory, and a job taken off the queue by another process would be
+        delivered with that process's copy of them. The gateway holds a lock key
+        in Redis, which it renews every third of GATEWAY_LOCK_TTL seconds. A
+        gateway that dies without releasing it is replaced once the key expires.
+        If the lock is lost anyway, the process exits rather than run alongside
+        the gateway that took it.
+
+        :return: None
+        """
+
+        key = f'{self.queue}:gateway'
+        token = uuid4().hex
+        while not await self._redis.set(key, token, nx=True, ex=GATEWAY_LOCK_TTL):
+            logger.warning('Another gateway process holds %s, waiting for it to stop', key)
+            await asyncio.sleep(GATEWAY_LOCK_TTL / 3)
+        asyncio.create_task(self._renew_gateway_lock(key, token))
+
+    async def _renew_gateway_lock(self, key, token):
+        while True:
+            await asyncio.sleep(GATEWAY_LOCK_TTL / 3)
+            try:
+                held = await self._redis.eval(RENEW_GATEWAY_LOCK, 1, key, token, GATEWAY_LOCK_TTL)
+            except Exception:
+                logger.exception('Failed to renew gateway lock %s', key)
+                continue
+            if not held:
+                logger.critical('Another gateway process took over %s, stopping', key)
+                raise SystemExit(1)
+
+    def stats(self) -> dict:
+        """
+        Get the broker's counters.
+
+        :return dict: The mode and the jobs published, rejected, consumed and deduplicated by this process.
+        """
+
+        return {'mode': PROCESS_MODE, 'queue': self.queue, 'published': self.published, 'rejected': self.rejected,
+                'consumed': self.consumed, 'duplicates': self.duplicates}
+
+
+broker = LocalBroker() if PROCESS_MODE == 'combined' else RedisBroker()
+
+
+async def enqueue(job):
+    """
+    Publish a job for the gateway to deliver.
+
+    :param dict job: The job. Its kind says what the gateway does with it.
+    :raises HTTPException: 503 if the broker is full.
+    :return: None
+    """
+
+    if not await broker.publish(job):
+        raise HTTPException(status_code=http.HTTPStatus.SERVICE_UNAVAILABLE, detail='Delivery queue is full.')
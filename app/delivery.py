@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import time
+
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+WEBHOOK_DEDUP_SIZE = int(os.getenv('WEBHOOK_DEDUP_SIZE', 10000))
+WEBHOOK_DEDUP_TTL = float(os.getenv('WEBHOOK_DEDUP_TTL', 24 * 60 * 60))
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryQueue:
+    """
+    Bounded queue of webhook notifications waiting to be sent to Discord.
+
+    Webhook routes only parse the payload and put a job on the queue, so GitHub
+    gets its response right away. A pool of worker tasks drains the queue and
+    hands each job to the deliver coroutine given to start(). The queue keeps
+    track of its depth and of how long jobs take from being enqueued to being
+    delivered.
+
+    Methods
+    --------
+    start(deliver):
+        Start the worker tasks.
+
+    put(job): bool
+        Enqueue a job without waiting.
+
+    put_wait(job):
+        Enqueue a job, waiting for room in the queue.
+
+    stats(): dict
+        Get the queue's depth and delivery latency.
+    """
+
+    def __init__(self, maxsize: int = WEBHOOK_QUEUE_SIZE, workers: int = WEBHOOK_WORKERS):
+        self.maxsize = maxsize
+        self.workers = workers
+        self._queue = None
+        self._tasks = []
+        self.enqueued = 0
+        self.delivered = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def start(self, deliver):
+        """
+        Create the queue and start the worker tasks on the running event loop.
+
+        :param deliver: Coroutine function called with each job.
+        :return: None
+        """
+
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker(deliver)) for _ in range(self.workers)]
+
+    def put(self, job) -> bool:
+        """
+        Enqueue a job without waiting for room in the queue.
+
+        :param job: The job to deliver.
+        :return bool: False if the queue is full (or not started) and the job was dropped.
+        """
+
+        if self._queue is None:
+            self.rejected += 1
+            return False
+        try:
+            self._queue.put_nowait((time.monotonic(), job))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    async def put_wait(self, job):
+        """
+        Enqueue a job, waiting until there is room in the queue.
+
+        :param job: The job to deliver.
+        :return: None
+        """
+
+        await self._queue.put((time.monotonic(), job))
+        self.enqueued += 1
+
+    async def _worker(self, deliver):
+        while True:
+            enqueued_at, job = await self._queue.get()
+            try:
+                await deliver(job)
+                self.delivered += 1
+            except Exception:
+                self.failed += 1
+                logger.exception('Failed to deliver webhook job %s', job)
+            finally:
+                latency = time.monotonic() - enqueued_at
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        """
+        Get the queue's depth and enqueue-to-delivery latency.
+
+        :return dict: Depth, capacity, job totals and latencies in ms.
+        """
+
+        done = self.delivered + self.failed
+        return {
+            'depth': self._queue.qsize() if self._queue is not None else 0,
+            'maxsize': self.maxsize,
+            'workers': self.workers,
+            'enqueued': self.enqueued,
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'avg_latency_ms': round(self.total_latency / done * 1000, 2) if done else 0.0,
+            'max_latency_ms': round(self.max_latency * 1000, 2),
+        }
+
+
+delivery_queue = DeliveryQueue()
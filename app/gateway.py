@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import discord
+from app.broker import broker, PROCESS_MODE
+from app.delivery import delivery_queue
+from bot.CollabyBot import DiscordCollabyBot
+from bot.utils.burndown import burndown_charts
+from bot.utils.github_client import github_clients, github_executor, github_rate_limits, github_repos, \
+    github_responses
+from bot.utils.jira_client import assignable_users, jira_clients, jira_executor, jira_resources
+from bot.utils.state_store import state_store
+
+# lean: only the intents the cogs use and no member or message caching; full: everything, as before
+DISCORD_INTENTS_PROFILE = os.getenv('DISCORD_INTENTS_PROFILE', 'lean')
+discordToken = os.getenv('DISCORD_BOT_TOKEN')  # get bot token
+# leave unset to let Discord pick the shard count. All shards always run in the one gateway process, since the
+# subscriptions and tokens live in its memory and it's the only consumer of the broker queue
+DISCORD_SHARD_COUNT = int(os.getenv('DISCORD_SHARD_COUNT')) if os.getenv('DISCORD_SHARD_COUNT') else None
+
+
+def bot_options():
+    """
+    Get the intents and cache options for the configured intents profile.
+
+    Every command is a slash command, so the lean profile only subscribes to
+    guild events (channels and the guild_remove cleanup), member events and
+    guild messages with their content (the yes/no replies the Jira instance and
+    reassign commands wait for). The members intent stays on because
+    on_member_remove needs it to drop a departing member's tokens from the
+    guild. Members, presences and messages aren't cached and guilds aren't
+    chunked at startup: guild cleanup finds the users whose tokens to drop in
+    the per-guild token owner index instead.
+
+    :return dict: Keyword arguments for DiscordCollabyBot.
+    """
+
+    if DISCORD_INTENTS_PROFILE == 'full':
+        return {'intents': discord.Intents.all()}
+
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.members = True
+    intents.guild_messages = True
+    intents.message_content = True
+    return {'intents': intents, 'member_cache_flags': discord.MemberCacheFlags.none(),
+            'chunk_guilds_at_startup': False, 'max_messages': None}
+
+
+def create_bot():
+    """
+    Create the bot instance and register all of its commands.
+
+    :return DiscordCollabyBot: The bot.
+    """
+
+    discordBot = DiscordCollabyBot(command_prefix='/', shard_count=DISCORD_SHARD_COUNT, **bot_options())
+    DiscordCollabyBot.add_all_commands(discordBot)  # register all bot commands before running the bot
+    return discordBot
+
+
+def status():
+    """
+    Report runtime counters for the bot and its background machinery.
+
+    :return dict: Counters, one entry per component.
+    """
+
+    # load_extension runs the cog modules again, so look them up only once the bot has loaded them
+    from bot.cogs.github_cog import gh_token_owners, repo_hooks, subscriptions
+    from bot.cogs.jira_cog import jira_token_owners
+
+    discordBot = getattr(DiscordCollabyBot, 'instance', None)
+    return {
+        'shards': discordBot.shard_stats() if discordBot is not None else [],
+        'gateway_events': discordBot.event_stats() if discordBot is not None else {},
+        'webhook_queue': delivery_queue.stats(),
+        'subscriptions': subscriptions.stats(),
+        'token_owners': {'github': gh_token_owners.stats(), 'jira': jira_token_owners.stats()},
+        'github': github_executor.stats(),
+        'github_clients': github_clients.stats(),
+        'github_repos': github_repos.stats(),
+        'github_hooks': repo_hooks.stats(),
+        'github_responses': github_responses.stats(),
+        'github_rate_limits': github_rate_limits.stats(),
+        'jira': jira_executor.stats(),
+        'jira_clients': jira_clients.stats(),
+        'jira_users': assignable_users.stats(),
+        'jira_resources': jira_resources.stats(),
+        'burndown_charts': burndown_charts.stats(),
+        'state_store': state_store.stats(),
+    }
+
+
+async def deliver(job):
+    """
+    Carry out a job taken off the delivery queue.
+
+    Notifications are sent to the channels subscribed to them, branch changes
+    update the branches known for the repository, and tokens from the auth
+    callbacks are handed to the cog that stores them.
+
+    :param dict job: The job published by a webhook or auth route.
+    :return: None
+    """
+
+    discordBot = DiscordCollabyBot()
+    kind = job.get('kind', 'notification')
+    if kind == 'notification':
+        await discordBot.get_cog('GitHubCog').send_payload_message(job['payload'], event=job['event'],
+                                                                   repo=job['repo'], branch=job['branch'])
+    elif kind == 'branch':
+        discordBot.get_cog('GitHubCog').update_branch(job['repo'], job['branch'], job['created'])
+    elif kind == 'github_token':
+        await discordBot.get_cog('GitHubCog').add_gh_token(job['token'])
+    elif kind == 'jira_token':
+        await discordBot.get_cog('JiraCog').jira_add_token(job['token'], job['expires'])
+
+
+async def run(discordBot):
+    """
+    Start the delivery workers and run the bot until it disconnects.
+
+    In gateway mode, jobs are also pulled from the shared broker queue.
+
+    :param discordBot: The bot created by create_bot().
+    :return: None
+    """
+
+    delivery_queue.start(deliver)
+    if PROCESS_MODE == 'gateway':
+        asyncio.create_task(broker.consume())
+    try:
+        await discordBot.start(discordToken)
+    finally:
+        await jira_resources.close()
+
+
+async def close():
+    """
+    Close shared HTTP sessions and write any state still buffered in the state store.
+
+    :return: None
+    """
+
+    await jira_resources.close()
+    state_store.close()
+
+
+async def run_gateway():
+    """
+    Run the gateway process once no other gateway process is running.
+
+    The bot is only created after the gateway lock is taken, so a standby
+    process loads the subscriptions and tokens when it takes over, not when it
+    starts. It's created on the running loop, which is the one py-cord uses.
+
+    :return: None
+    """
+
+    if PROCESS_MODE == 'gateway':
+        await broker.lock_gateway()
+    await run(create_bot())
+
+
+def main():
+    """
+    Entry point of the gateway process, started with python -m app.gateway.
+
+    :return: None
+    """
+
+    logging.basicConfig(level=logging.ERROR)
+    try:
+        asyncio.run(run_gateway())
+    finally:
+        state_store.close()
+
+
+if __name__ == '__main__':
+    main()
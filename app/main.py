@@ -1,25 +1,30 @@
 import os
 from dotenv import load_dotenv
-import discord
 import asyncio
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 import http
 import uvicorn
 import nest_asyncio
-from app.routers import webhook, auth
-import bot
-from bot.CollabyBot import DiscordCollabyBot
+from app.broker import PROCESS_MODE
+from app.routers import webhook, auth, status
 import logging
 
 logging.basicConfig(level=logging.ERROR)
 
 nest_asyncio.apply()  # needed to prevent errors caused by nested async tasks
 # load_dotenv()  # load env file
-intents = discord.Intents().all()  # default to all intents for bot
-discordToken = os.getenv('DISCORD_BOT_TOKEN')  # get bot token
-discordBot = DiscordCollabyBot(intents=intents, command_prefix='/')  # create the bot instance
-DiscordCollabyBot.add_all_commands(discordBot)  # register all bot commands before running the bot
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 1))
+if PROCESS_MODE == 'combined' and WEB_WORKERS > 1:
+    # every worker would run its own bot, with its own copy of the state
+    raise RuntimeError('PROCESS_MODE=combined runs the bot in the web process, so it needs WEB_WORKERS=1. '
+                       'Use PROCESS_MODE=ingress with a separate gateway process to run more web workers.')
+if PROCESS_MODE == 'combined':
+    from app import gateway
+    discordBot = gateway.create_bot()
+else:
+    # the bot runs in the separate gateway process, so it isn't even imported here
+    discordBot = None
 PORT = os.getenv('PORT') or 8000
 
 
@@ -31,6 +36,7 @@ app = FastAPI(
 
 app.include_router(webhook.router)
 app.include_router(auth.router)
+app.include_router(status.router)
 
 app.payload = " "
 
@@ -56,16 +62,25 @@ async def startup_event():
     Run the Discord bot as an asyncio task before starting the FastAPI server.
 
     This is needed to prevent the bot from blocking the server from executing
-    any further code.
+    any further code. The webhook delivery workers are started on the same loop.
+    In ingress mode, jobs are published to the broker for the gateway process
+    instead, and nothing is started here.
 
     :return: None
     """
-    asyncio.create_task(discordBot.start(discordToken))
+    if discordBot is not None:
+        asyncio.create_task(gateway.run(discordBot))
 
 
-# @app.on_event("shutdown")
-# async def shutdown_event():
-#     cog = discordBot.get_cog('GitHubCog')
-#     cog.save_dicts()
-#     cog = discordBot.get_cog('JiraCog')
-#     cog.save_dicts()
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Write any state still buffered in the state store and close shared HTTP sessions before the server exits.
+
+    Only combined mode has any, since ingress workers keep no state.
+
+    :return: None
+    """
+    if discordBot is not None:
+        await gateway.close()
+
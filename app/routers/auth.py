@@ -9,7 +9,7 @@ from asyncio import Lock
 import os
 from fastapi.responses import RedirectResponse, Response
 import requests
-from bot.CollabyBot import DiscordCollabyBot
+from app.broker import enqueue
 from uuid import UUID, uuid4
 
 from hashlib import sha256
@@ -25,7 +25,6 @@ JIRA_CLIENT_SECRET = os.getenv('JIRA_CLIENT_SECRET')
 HOME_URL = os.getenv('HOME_URL')
 JIRA_API_URL = os.getenv('JIRA_API_URL')
 JIRA_RESOURCES_ENDPOINT = os.getenv('JIRA_RESOURCES_ENDPOINT')
-bot = DiscordCollabyBot()
 
 
 @router.get("/auth/github", tags=['auth'], status_code=http.HTTPStatus.ACCEPTED,
@@ -48,7 +47,7 @@ async def gh_callback(code: str):
                       },
                       headers={'Accept': 'application/json'})
     token = r.json()['access_token']
-    await bot.get_cog('GitHubCog').add_gh_token(token)
+    await enqueue({'kind': 'github_token', 'token': token})
 
 
 @router.get('/auth/jira', tags=['auth'], status_code=http.HTTPStatus.ACCEPTED,
@@ -78,7 +77,7 @@ async def jira_callback(state: str, code: str):
     print(r.content)
     token = r.json()['access_token']
     expires = datetime.now() + timedelta(seconds=r.json()['expires_in'])
-    await bot.get_cog('JiraCog').jira_add_token(token, expires.strftime("%Y-%m-%d %H:%M:%S"))
+    await enqueue({'kind': 'jira_token', 'token': token, 'expires': expires.strftime("%Y-%m-%d %H:%M:%S")})
 
 
 
@@ -0,0 +1,23 @@
+from fastapi import APIRouter
+import http
+from app.broker import broker, PROCESS_MODE
+
+router = APIRouter()
+
+
+@router.get("/status", tags=['status'], status_code=http.HTTPStatus.OK)
+async def status():
+    """
+    Report runtime counters for CollabyBot's background machinery.
+
+    Ingress workers only report their broker, since the bot, its state and its
+    delivery queue live in the gateway process.
+
+    :return: Dict of counters, one entry per component.
+    """
+
+    report = {'broker': broker.stats()}
+    if PROCESS_MODE == 'combined':
+        from app import gateway  # already imported by app.main in this mode
+        report.update(gateway.status())
+    return report
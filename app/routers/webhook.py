@@ -1,141 +1,229 @@
-from bot.CollabyBot import DiscordCollabyBot
 from fastapi import Request, APIRouter
 import http
-from pprint import pprint
+import orjson
+from app.broker import broker, enqueue
 from bot.github_objects import *
 
 router = APIRouter()
-discordBot = DiscordCollabyBot()
 
-@router.post("/webhook/commits", tags=['webhook'], status_code=http.HTTPStatus.ACCEPTED)
-async def payload_handler_commits(
-        request: Request
-):
+event_handlers = {}  # X-GitHub-Event value -> handler
+
+
+def event_handler(event):
     """
-    Triggered when a commit event is received from GitHub.
+    Register a function as the handler for a GitHub event type.
 
-    When a payload is received, the commit's message, repository, author, timestamp,
-    action type, and URL are extracted to create a Commit object. A string representation
-    of the object is sent to the bot using send_payload_message along with the branch
-    the commit was pushed to.
+    Handlers receive the parsed payload and return the job to publish for it, or
+    None if there is nothing to send.
 
-    :param Request request: Request header of the payload.
-    :raises AttributeError: Raised if no branch is specified in the response.
-    :return: None
+    :param str event: Value of the X-GitHub-Event header the handler is for.
+    :return: The decorator.
     """
 
-    if request.headers['X-Github-Event'] == 'ping':
-        pass
-    else:
-        payload_json = await request.json()
-        # TODO: Add status check, add modifief param
-        repo = payload_json.get('repository')['full_name']
+    def register(func):
+        event_handlers[event] = func
+        return func
 
-        # Get branch
-        try:
-            branch = payload_json.get('ref').split('/')[-1]
-        except AttributeError:  # if ref isn't in the response, it came from the main branch
-            print('No branch information in payload. Defaulting to main.')
-            branch = 'main'
+    return register
 
-        commit = Commit(str(payload_json.get('commits')[0].get('message')), 'commit',
-                        str(payload_json.get('repository').get('full_name')),
-                        str(payload_json.get('commits')[0].get('timestamp')),
-                        str(payload_json.get('commits')[0].get('url')),
-                        str(payload_json.get('commits')[0].get('author').get('name')))
-        await discordBot.get_cog('GitHubCog').send_payload_message(commit.object_string(), event='push', repo=repo,
-                                                                   branch=branch)
 
+def branch_name(ref):
+    """
+    Get a branch name from a git ref such as refs/heads/main.
+
+    :param str ref: The ref from the payload.
+    :return str: The branch name, or main if the payload has no ref.
+    """
+
+    if not ref:
+        return 'main'
+    return ref[len('refs/heads/'):] if ref.startswith('refs/heads/') else ref
+
+
+def notification(payload, event, repo, branch):
+    """
+    Create the job for a notification to the channels subscribed to an event.
+
+    :param payload: The payload formatted as a notification string.
+    :param event: The event type of the payload.
+    :param repo: Full name of the repository the event came from.
+    :param branch: Branch the event happened on.
+    :return dict: The job, ready to be published.
+    """
 
-@router.post("/webhook/issues", tags=['webhook'], status_code=http.HTTPStatus.ACCEPTED)
-async def payload_handler_issues(
+    return {'kind': 'notification', 'payload': payload, 'event': event, 'repo': repo, 'branch': branch}
+
+
+@router.post("/webhook/github", tags=['webhook'], status_code=http.HTTPStatus.ACCEPTED)
+@router.post("/webhook/commits", tags=['webhook'], status_code=http.HTTPStatus.ACCEPTED, include_in_schema=False)
+@router.post("/webhook/issues", tags=['webhook'], status_code=http.HTTPStatus.ACCEPTED, include_in_schema=False)
+@router.post("/webhook/pull-request", tags=['webhook'], status_code=http.HTTPStatus.ACCEPTED, include_in_schema=False)
+async def github_webhook(
         request: Request
 ):
     """
-    Triggered when a issue event is received from GitHub.
+    Triggered when any event is received from GitHub.
 
-    When a payload is received, the issue's body, action type, repository URL,
-    associated user, and time of creation are extracted from the response
-    object and used to create an Issue object. A string representation of the
-    object is sent to the bot using send_payload_message.
+    The event type is read from the X-GitHub-Event header and the payload is
+    passed to the handler registered for it. The body is only parsed if there is
+    a handler, so pings and events CollabyBot doesn't use cost nothing. The old
+    per-event paths are aliases of this route, so hooks created before it keep
+    working.
+
+    GitHub redelivers a webhook with the same X-GitHub-Delivery id, so ids seen
+    recently are remembered and their redeliveries are dropped before the body
+    is read. If the delivery can't be queued, its id is forgotten again so a
+    retry isn't mistaken for a duplicate.
 
     :param Request request: Request header of the payload.
-    :raises AttributeError: Raised if no branch is specified in the response.
     :return: None
     """
 
-    if request.headers['X-Github-Event'] == 'ping':
-        pass
-    else:
-        payload_json = await request.json()
-        # TODO: Add status check, add modified param
-        repo = payload_json.get('repository')['full_name']
+    handler = event_handlers.get(request.headers.get('X-GitHub-Event'))
+    if handler is None:
+        return
+
+    delivery = request.headers.get('X-GitHub-Delivery')
+    if delivery is not None and not await broker.claim(delivery):
+        return
+    try:
+        job = handler(orjson.loads(await request.body()))
+        if job is not None:
+            await enqueue(job)
+    except Exception:
+        if delivery is not None:
+            await broker.release(delivery)
+        raise
+
+
+@event_handler('push')
+def handle_push(payload):
+    """
+    Handle a push event.
 
-        try:
-            branch = payload_json.get('ref').split('/')[-1]
-        except AttributeError:  # if ref isn't in the response, it came from the main branch
-            print('No branch information in payload. Defaulting to main.')
-            branch = 'main'
+    Every commit in the push is summarized in a single PushDigest, so a push
+    results in one notification however many commits it has. Pushes without
+    commits (force-pushes to an older commit, new or deleted branches) still
+    produce a digest describing what happened to the branch. Tag pushes are
+    ignored, like tags in create and delete events.
 
-        issue = Issue(str(payload_json.get('issue').get('body')), str(payload_json.get('action')),
-                      str(payload_json.get('repository').get('full_name')),
-                      str(payload_json.get('issue').get('created_at')), str(payload_json.get('issue').get('html_url')),
-                      str(payload_json.get('issue').get('user').get('login')))
-        await discordBot.get_cog('GitHubCog').send_payload_message(issue.object_string(), event='issue', repo=repo,
-                                                                   branch=branch)
+    :param dict payload: The parsed payload.
+    :return dict: The notification job, or None if a tag was pushed.
+    """
 
+    if (payload.get('ref') or '').startswith('refs/tags/'):
+        return None
+    repo = payload['repository']['full_name']
+    branch = branch_name(payload.get('ref'))
+    pusher = (payload.get('pusher') or {}).get('name') or (payload.get('sender') or {}).get('login')
 
-@router.post("/webhook/pull-request", tags=['webhook'], status_code=http.HTTPStatus.ACCEPTED)
-async def payload_handler_pr(
-        request: Request
-):
+    digest = PushDigest(repo, branch, pusher, payload.get('commits') or [], payload.get('compare'),
+                        created=payload.get('created', False), deleted=payload.get('deleted', False),
+                        forced=payload.get('forced', False), head=payload.get('after'))
+    return notification(digest.object_string(), event='push', repo=repo, branch=branch)
+
+
+@event_handler('issues')
+def handle_issues(payload):
     """
-    Triggered when a pull-request event is received from GitHub.
+    Handle an issues event.
 
-    When a payload is received, the pull request's reviewer, status, review body,
-    reviewer requested flag, action, repository, associated user, URL, and
-    action type are extracted from the response object and used to create a
-    PullRequest object. A string representation of the object is sent to the bot
-    using send_payload_message.
+    The issue's body, action type, repository URL, associated user, and time of
+    creation are extracted to create an Issue object, and a string representation
+    of the object is sent.
 
-    :param Request request: Request header of the payload.
-    :raises AttributeError: Raised if no branch is specified in the response.
-    :return: None
+    :param dict payload: The parsed payload.
+    :return dict: The notification job.
+    """
+
+    repo = payload['repository']['full_name']
+    issue = payload['issue']
+
+    issue = Issue(str(issue.get('body')), str(payload.get('action')), repo, str(issue.get('created_at')),
+                  str(issue.get('html_url')), str(issue['user'].get('login')))
+    return notification(issue.object_string(), event='issue', repo=repo, branch=None)
+
+
+@event_handler('pull_request')
+def handle_pull_request(payload):
+    """
+    Handle a pull_request event.
+
+    The pull request's reviewer, status, review body, reviewer requested flag,
+    action, repository, associated user, URL, and action type are extracted to
+    create a PullRequest object, and a string representation of the object is
+    sent.
+
+    :param dict payload: The parsed payload.
+    :return dict: The notification job.
+    """
+
+    repo = payload['repository']['full_name']
+    pull_request = payload['pull_request']
+    review = payload.get('review')
+
+    reviewer_requested = None
+    reviewer = None
+    pr_state = None
+    review_body = None
+    timestamp = pull_request['updated_at']
+
+    # if review is in the response, get review information
+    if review is not None:
+        reviewer = review['user']['login']
+        pr_state = review['state']
+        review_body = review['body']
+        timestamp = review['submitted_at']
+    # get requested reviewer if there is one
+    elif payload.get('action') == 'review_requested' and payload.get('requested_reviewer') is not None:
+        reviewer_requested = payload['requested_reviewer']['login']
+
+    PR = PullRequest(payload.get('action'), pull_request['body'], repo, timestamp, pull_request['html_url'],
+                     pull_request['user']['login'], reviewer_requested, reviewer, review_body, pr_state)
+    return notification(PR.object_string(), event='pull_request', repo=repo, branch=None)
+
+
+def branch_change(payload, created):
+    """
+    Create the job for a branch being created or deleted.
+
+    :param dict payload: The parsed create or delete payload.
+    :param bool created: True if the branch was created, False if it was deleted.
+    :return dict: The branch job, or None if the ref is a tag.
+    """
+
+    if payload.get('ref_type') != 'branch':
+        return None
+    return {'kind': 'branch', 'repo': payload['repository']['full_name'], 'branch': payload['ref'],
+            'created': created}
+
+
+@event_handler('create')
+def handle_create(payload):
+    """
+    Handle a create event.
+
+    New branches are added to the branches known for the repository, so commit
+    subscriptions see them without the branch list being fetched again. Tags
+    are ignored.
+
+    :param dict payload: The parsed payload.
+    :return dict: The branch job, or None for tags.
+    """
+
+    return branch_change(payload, created=True)
+
+
+@event_handler('delete')
+def handle_delete(payload):
+    """
+    Handle a delete event.
+
+    Deleted branches are removed from the branches known for the repository,
+    along with subscriptions to them. Tags are ignored.
+
+    :param dict payload: The parsed payload.
+    :return dict: The branch job, or None for tags.
     """
 
-    if request.headers['X-Github-Event'] == 'ping':
-        pass
-    else:
-        payload_json = await request.json()
-        repo = payload_json.get('repository')['full_name']
-
-        try:
-            branch = payload_json.get('ref').split('/')[-1]
-        except AttributeError:  # if ref isn't in the response, it came from the main branch
-            print('No branch information in payload. Defaulting to main.')
-            branch = 'main'
-
-        reviewer_requested = None
-        reviewer = None
-        pr_state = None
-        review_body = None
-        timestamp = payload_json["pull_request"]["updated_at"]
-
-        # if review is in the response, get review information
-        if payload_json.get('review') is not None:
-            reviewer = payload_json["review"]["user"]["login"]
-            pr_state = payload_json["review"]["state"]
-            review_body = payload_json["review"]["body"]
-            timestamp = payload_json["review"]["submitted_at"]
-        # get requested reviewer if there is one
-        elif payload_json.get('action') == 'review_requested':
-            reviewer_requested = payload_json["requested_reviewer"]["login"]
-        else:
-            pass
-        # TODO: Add status check
-        PR = PullRequest(payload_json.get('action'), payload_json["pull_request"]["body"],
-                         payload_json["repository"]["full_name"], timestamp,
-                         payload_json["pull_request"]["html_url"],
-                         payload_json["pull_request"]["user"]["login"], reviewer_requested, reviewer, review_body, pr_state)
-        await discordBot.get_cog('GitHubCog').send_payload_message(PR.object_string(), event='pull_request', repo=repo,
-                                                                   branch=branch)
\ No newline at end of file
+    return branch_change(payload, created=False)
@@ -1,19 +1,23 @@
+import math
+from collections import Counter
 import discord
 from discord import Guild, ApplicationCommand
 from discord.ext import commands
-from discord.ext.commands import Bot, guild_only, errors
+from discord.ext.commands import AutoShardedBot, guild_only, errors
 from discord.ext.commands.errors import CommandInvokeError
 from github import Github
 from jira import JIRA, JIRAError
 from discord.ext.pages import Page, Paginator
 
-class DiscordCollabyBot(Bot):
+class DiscordCollabyBot(AutoShardedBot):
     """
     Discord implementation of CollabyBot.
 
-    Extends the Bot class from discord.ext.commands. on_message() and
-    on_ready() are overridden methods from the discord module for handling
-    events in Discord.
+    Extends the AutoShardedBot class from discord.ext.commands, so guilds are
+    spread over as many gateway connections (shards) as Discord recommends, or
+    as configured with shard_count. on_message() and on_ready()
+    are overridden methods from the discord module for handling events in
+    Discord.
 
     Methods
     --------
@@ -65,6 +69,12 @@ class DiscordCollabyBot(Bot):
     add_all_commands(bot):
         Register all slash commands with the Discord bot.
 
+    shard_stats(): list
+        Get the latency and guild count of each shard.
+
+    event_stats(): dict
+        Get the number of gateway events received, by event type.
+
     """
 
     def __new__(cls, *args, **kwargs):
@@ -72,6 +82,13 @@ class DiscordCollabyBot(Bot):
             cls.instance = super(DiscordCollabyBot, cls).__new__(cls)
         return cls.instance
 
+    def __init__(self, *args, **kwargs):
+        if getattr(self, '_initialized', False):
+            return  # the singleton is set up once, later calls only return it
+        super().__init__(*args, **kwargs)
+        self.gateway_events = Counter()  # gateway events received by all shards, by event type
+        self._initialized = True
+
     async def on_ready(self):
         """
         Triggered when the bot becomes operational.
@@ -84,6 +101,50 @@ class DiscordCollabyBot(Bot):
 
         print(f'{self.user} is now running!')
 
+    async def on_socket_event_type(self, event_type):
+        """
+        Triggered for every event received from the gateway.
+
+        :param str event_type: The event's type, e.g. GUILD_CREATE.
+        :return: None
+        """
+
+        self.gateway_events[event_type] += 1
+
+    def event_stats(self):
+        """
+        Get the number of gateway events received since the bot started.
+
+        py-cord doesn't say which shard an event came in on, so events are
+        counted for all shards together.
+
+        :return dict: The total and the count of each event type.
+        """
+
+        return {'total': sum(self.gateway_events.values()), 'by_type': dict(self.gateway_events)}
+
+    def shard_stats(self):
+        """
+        Get the state of each shard.
+
+        :return list: Dicts with the shard's ID, latency in ms, guild count and whether it's closed.
+        """
+
+        guilds = {}
+        for guild in self.guilds:
+            guilds[guild.shard_id] = guilds.get(guild.shard_id, 0) + 1
+
+        stats = []
+        for shard_id, shard in sorted(self.shards.items()):
+            latency = shard.latency
+            stats.append({
+                'shard': shard_id,
+                'latency_ms': round(latency * 1000, 2) if math.isfinite(latency) else None,
+                'guilds': guilds.get(shard_id, 0),
+                'closed': shard.is_closed(),
+            })
+        return stats
+
     async def on_message(self, message):
         """
         Triggered when a message is received.
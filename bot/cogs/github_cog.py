@@ -1,44 +1,44 @@
 import asyncio
 import os
+import sys
+import time
+import traceback
 from queue import Queue
 import discord
 from discord import Guild, Member
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ext.bridge import guild_only
 from discord.ext.commands import Context
-from discord.ext.pages import Page, Paginator
-from github.MainClass import Github
-from github.GithubException import UnknownObjectException, GithubException
+from discord.ext.pages import Page
+from github.GithubException import UnknownObjectException, GithubException, RateLimitExceededException
 import json
 from bot.embeds import *
-
-# with open('bot/cogs/json_/repos.json') as f:
-#     repos = json.load(f)  # repo names and list of branches
-#     f.close()
-# with open('bot/cogs/json_/pr_subscribers.json') as f:
-#     pr_subscribers = json.load(f)  # channel ids of channels subscribed to pull requests
-#     f.close()
-# with open('bot/cogs/json_/commit_subscribers.json') as f:
-#     commit_subscribers = json.load(f)  # channel ids of channels subscribed to commits, one list per branch
-#     f.close()
-# with open('bot/cogs/json_/issue_subscribers.json') as f:
-#     issue_subscribers = json.load(f)  # channel ids of channels subscribed to issues
-#     f.close()
-# with open('bot/cogs/json_/gh_tokens.json') as f:
-#     gh_tokens = json.load(f)  # channel ids of channels subscribed to issues
-#     f.close()
-
-gh_tokens = {}
-pr_subscribers = {}
-commit_subscribers = {}
-issue_subscribers = {}
-repos = {}
+from bot.utils.github_client import github_clients, github_executor, get_issue, get_pull, get_repo, GITHUB_PER_PAGE
+from bot.utils.hooks import HookManager
+from bot.utils.paginator import LazyPaginator
+from bot.utils.state_store import state_store, StoredDict
+from bot.utils.subscriptions import SubscriptionIndex, PUSH, ISSUE, PULL_REQUEST, ALL_BRANCHES
+from bot.utils.token_owners import TokenOwnerIndex
+
+# State is loaded from the state store once at startup and written back to it in the background
+gh_tokens = StoredDict(state_store, 'gh_tokens')
+gh_token_owners = TokenOwnerIndex(state_store, 'gh_token_owners')  # guilds each token owner uses the bot in
+subscriptions = SubscriptionIndex(state_store)  # repos tracked by each guild and the channels subscribed to them
 
 HOME_URL = os.getenv('HOME_URL')
 
+repo_hooks = HookManager(f'{HOME_URL}/webhook/github', subscriptions, state_store, 'repo_hooks')  # hook of each repo
+
 auth_queue = Queue(maxsize=1)
 queue_lock = asyncio.Lock()
 
+FANOUT_CONCURRENCY = int(os.getenv('FANOUT_CONCURRENCY', 10))
+fanout_limit = asyncio.Semaphore(FANOUT_CONCURRENCY)  # caps concurrent channel sends across all notifications
+
+# create/delete webhooks keep branches up to date, this only catches what they missed (e.g. while the bot was down)
+BRANCH_RECONCILE_HOURS = float(os.getenv('BRANCH_RECONCILE_HOURS', 24))
+branch_reconcile = StoredDict(state_store, 'branch_reconcile')  # when the branches were last reconciled
+
 
 class GitHubCog(commands.Cog):
     def __init__(self, bot):
@@ -52,32 +52,171 @@ class GitHubCog(commands.Cog):
     unsubscribe = github.create_subgroup('unsubscribe', 'Unsubscribe channel to GitHub notifications.')
     fetch = github.create_subgroup('fetch', 'Fetch information about GitHub repositories.')
 
+    async def cog_after_invoke(self, ctx: discord.ApplicationContext):
+        """
+        Link the user who ran a command to the guild, if they have a token.
+
+        :return: None
+        """
+
+        if ctx.guild_id is not None and str(ctx.author.id) in gh_tokens:
+            gh_token_owners.link(str(ctx.guild_id), str(ctx.author.id))
+
+    async def cog_command_error(self, ctx: discord.ApplicationContext, error):
+        """
+        Tell the user when their rate limit resets if a command ran out of it.
+
+        Any other error is printed, like the bot's default error handler does.
+
+        :return: None
+        """
+
+        original = getattr(error, 'original', error)
+        if isinstance(original, RateLimitExceededException):
+            reset = (original.headers or {}).get('x-ratelimit-reset')
+            await ctx.respond(embed=GitHubRateLimitError(int(reset) if reset else None))
+        else:
+            print(f'Ignoring exception in command {ctx.command}:', file=sys.stderr)
+            traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+
     @commands.Cog.listener()
-    async def on_guild_join(self, guild: Guild):
-        server = str(guild.id)
-        repos[server] = {}
+    async def on_ready(self):
+        if not self.reconcile_branches.is_running():
+            self.reconcile_branches.start()
+
+    def update_branch(self, repo: str, branch: str, created: bool):
+        """
+        Update the branches known for a repository from a create or delete webhook.
+
+        :param str repo: Full name of the repository.
+        :param str branch: Name of the branch.
+        :param bool created: True if the branch was created, False if it was deleted.
+        :return: None
+        """
+
+        if created:
+            subscriptions.add_branch(repo, branch)
+        else:
+            subscriptions.remove_branch(repo, branch)
+
+    def repo_tokens(self, repo: str):
+        """
+        Find the tokens that can be used for background work on a repository.
+
+        :param str repo: Full name of the repository.
+        :return list: The tokens of users in the guilds tracking the repository.
+        """
+
+        tokens = []
+        for guild in subscriptions.repo_guilds(repo):
+            for user in gh_token_owners.guild_users(guild):
+                token = gh_tokens.get(user)
+                if token is not None and token not in tokens:
+                    tokens.append(token)
+        return tokens
+
+    @tasks.loop(hours=BRANCH_RECONCILE_HOURS)
+    async def reconcile_branches(self):
+        """
+        Re-list the branches of every tracked repository.
+
+        Runs every BRANCH_RECONCILE_HOURS as background work, so it never takes
+        rate limit budget from commands. Branches are listed page by page, and
+        pages that haven't changed since the last run are answered from the
+        ETag cache. The time of the last run is kept in the state store, so
+        restarts and reconnects don't start it over.
+
+        Repositories tracked since before the shared webhook have no known hook,
+        so their old push-only hooks are replaced here, which is what makes
+        create and delete events (and so new branches) reach them.
+
+        :return: None
+        """
+
+        branch_reconcile['last_run'] = time.time()
+        for repo in subscriptions.repos():
+            tokens = self.repo_tokens(repo)
+            if not tokens:
+                continue
+            token = tokens[0]
+
+            def get_branch_names():
+                return [b.name for b in get_repo(token, repo, lazy=True).get_branches()]
+
+            try:
+                branches = await github_executor.run_background(get_branch_names)
+            except GithubException as ex:
+                print(f'Could not reconcile branches of {repo}: {ex}')
+                continue
+            subscriptions.set_branches(repo, branches)
+
+            if repo_hooks.hook_id(repo) is None:
+                await self.migrate_hook(repo, tokens)
+
+    @reconcile_branches.before_loop
+    async def before_reconcile_branches(self):
+        # the loop would run right away, so wait out what's left of the interval since the last run
+        delay = branch_reconcile.get('last_run', 0) + BRANCH_RECONCILE_HOURS * 60 * 60 - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def migrate_hook(self, repo: str, tokens):
+        """
+        Give a repository without a known hook the shared webhook.
+
+        Installing hooks takes admin access to the repository, so each token is
+        tried until one of them succeeds.
+
+        :param str repo: Full name of the repository.
+        :param tokens: Tokens of users in the guilds tracking the repository.
+        :return: None
+        """
+
+        for token in tokens:
+            def install_hook():
+                repo_hooks.acquire(get_repo(token, repo))
+
+            try:
+                await github_executor.run_background(install_hook)
+                return
+            except GithubException as ex:
+                print(f'Could not install the webhook of {repo}: {ex}')
 
     @commands.Cog.listener()
     async def on_guild_remove(self, guild: Guild):
+        """
+        Delete the guild's repositories and subscriptions, the webhooks of repositories
+        no other guild tracks, and the tokens of users who don't use the bot in any
+        other guild.
 
-        server = str(guild.id)
-        members = guild.members
-
-        for user in members:
-            if gh_tokens.get(str(user.id)) is not None:
-                gh_tokens.pop(str(user.id))
+        :return: None
+        """
 
-        for repo in repos.get(server):
-            if issue_subscribers.get(repo) is not None:
-                issue_subscribers.pop(repo)
-            if commit_subscribers.get(repo) is not None:
-                commit_subscribers.pop(repo)
-            if pr_subscribers.get(repo) is not None:
-                pr_subscribers.pop(repo)
+        server = str(guild.id)
 
-        if repos.get(server) is not None:
-            repos.pop(server)
-        # self.save_dicts()
+        # the hooks of repos no other guild tracks are deleted with the token of an owner who is an admin of the
+        # repo, so collect the tokens before they're dropped
+        tokens = [gh_tokens[user] for user in gh_token_owners.guild_users(server) if user in gh_tokens]
+        repos = subscriptions.guild_repos(server)
+        subscriptions.remove_guild(server)
+        for repo in repos:
+            if repo_hooks.hook_id(repo) is None or subscriptions.repo_guilds(repo):
+                continue
+            deleted = False
+            for token in tokens:
+                try:
+                    deleted = await github_executor.run_background(repo_hooks.release, token, repo)
+                except GithubException as ex:
+                    print(f'Could not delete the webhook of {repo}: {ex}')
+                if deleted:
+                    break
+            if not deleted:
+                print(f'The webhook of {repo} was not deleted, since no owner\'s token could delete it')
+
+        for user in gh_token_owners.remove_guild(server):
+            token = gh_tokens.pop(user, None)
+            if token is not None:
+                github_clients.invalidate(token)
 
     @commands.Cog.listener()
     async def on_member_remove(self, member: Member):
@@ -95,26 +234,10 @@ class GitHubCog(commands.Cog):
 
         user = str(member.id)
 
-        if gh_tokens.get(user) is not None:
-            gh_tokens.pop(user)
-        # self.save_dicts()
-
-    # def save_dicts(self):
-    #     with open('bot/cogs/json_/repos.json', 'w') as f:
-    #         json.dump(repos, f)  # repo names and list of branches
-    #         f.close()
-    #     with open('bot/cogs/json_/pr_subscribers.json', 'w') as f:
-    #         json.dump(pr_subscribers, f)  # channel ids of channels subscribed to pull requests
-    #         f.close()
-    #     with open('bot/cogs/json_/commit_subscribers.json', 'w') as f:
-    #         json.dump(commit_subscribers, f)  # channel ids of channels subscribed to commits, one list per branch
-    #         f.close()
-    #     with open('bot/cogs/json_/issue_subscribers.json', 'w') as f:
-    #         json.dump(issue_subscribers, f)  # channel ids of channels subscribed to issues
-    #         f.close()
-    #     with open('bot/cogs/json_/gh_tokens.json', 'w') as f:
-    #         json.dump(gh_tokens, f)  # channel ids of channels subscribed to issues
-    #         f.close()
+        token = gh_tokens.pop(user, None)
+        if token is not None:
+            github_clients.invalidate(token)
+        gh_token_owners.remove_user(user)
 
     async def send_payload_message(self, payload, event, repo, branch='main'):
         """
@@ -130,23 +253,56 @@ class GitHubCog(commands.Cog):
             embed = discord.Embed(title='GitHub Event Notification',
                                   color=discord.Color.teal())
             embed.add_field(name='Pull Request', value=payload, inline=False)
-            for channel in pr_subscribers[repo]:
-                await self.bot.get_channel(int(channel)).send(embed=embed)
+            channels = subscriptions.channels(repo, PULL_REQUEST)
         elif event == 'issue':
             embed = discord.Embed(title='GitHub Event Notification',
                                   color=discord.Color.magenta())
             embed.add_field(name='Issue', value=payload, inline=False)
-            for channel in issue_subscribers[repo]:
-                await self.bot.get_channel(int(channel)).send(embed=embed)
+            channels = subscriptions.channels(repo, ISSUE)
         elif event == 'push':
+            embed = discord.Embed(title='GitHub Event Notification',
+                                  color=discord.Color.purple())
+            embed.add_field(name='Push', value=payload, inline=False)
+            channels = subscriptions.channels(repo, PUSH, branch)
+        else:
+            return
+
+        if not channels:
+            print('No subscribers')
+            return
+        await self.fan_out(channels, embed)
+
+    async def fan_out(self, channels, embed):
+        """
+        Send an embed to several channels at once.
+
+        Sends run concurrently, but no more than FANOUT_CONCURRENCY at a time
+        across all notifications. py-cord's HTTP client holds each send until
+        the channel's rate limit bucket (and the global bucket) has room, so a
+        slow or rate-limited channel only delays itself. A channel that can't be
+        found or refuses the message is skipped without affecting the others.
+
+        Channels are looked up in the cache first. Channels that aren't cached
+        (e.g. while their shard is still connecting) are sent to through a
+        partial messageable, which only needs the channel's ID.
+
+        :param channels: IDs of the channels to send to.
+        :param embed: The embed to send.
+        :return int: Number of channels the embed was delivered to.
+        """
+
+        results = await asyncio.gather(*(self._send_to_channel(channel, embed) for channel in set(channels)))
+        return sum(results)
+
+    async def _send_to_channel(self, channel_id, embed):
+        async with fanout_limit:
+            channel = self.bot.get_channel(int(channel_id)) or self.bot.get_partial_messageable(int(channel_id))
             try:
-                embed = discord.Embed(title='GitHub Event Notification',
-                                      color=discord.Color.purple())
-                embed.add_field(name='Commit', value=payload, inline=False)
-                for channel in commit_subscribers.get(repo).get(branch):
-                    await self.bot.get_channel(int(channel)).send(embed=embed)
-            except TypeError:
-                print('No subscribers')
+                await channel.send(embed=embed)
+            except discord.HTTPException as ex:
+                print(f'Could not send notification to channel {channel_id}: {ex}')
+                return False
+            return True
 
     @subscribe.command(name='pull-requests', description='Subscribe to pull request notifications in this channel.')
     @guild_only()
@@ -165,26 +321,25 @@ class GitHubCog(commands.Cog):
         server = str(ctx.guild_id)
         if repo == '':
             await ctx.respond(embed=UsageMessage('/github pull-requests subscribe <REPO_NAME>'))
-            if not repos.get(server):
+            if not subscriptions.guild_repos(server):
                 await ctx.respond(embed=HelpEmbed('No Repositories Added',
                                                   'You haven\'t added any repositories to CollabyBot yet. '
                                                   'Use /github repo add <REPO_OWNER>/<REPO_NAME> to add one.'))
             else:
                 repo_list = ''
-                for r in repos[server].keys():
+                for r in subscriptions.guild_repos(server):
                     repo_list += f'{r}\n'
                 await ctx.respond('Subscribe to one of the following added repositories using '
                                   '**/gh-pull-requests <REPO_NAME>**:',
                                   embed=HelpEmbed('Available Repositories', f'{repo_list}'))
-        elif repo not in repos[server].keys():
+        elif not subscriptions.has_repo(server, repo):
 
             await ctx.respond(embed=discord.Embed(
                 color=discord.Color.yellow(),
                 description=f'Repository {repo} hasn\'t been added to CollabyBot yet. '
                             f'Use /github repo add <REPO_OWNER>/<REPO_NAME> to add it.')
             )
-        elif channel not in pr_subscribers[repo]:
-            pr_subscribers[repo].append(channel)
+        elif subscriptions.subscribe(server, channel, repo, PULL_REQUEST):
             await ctx.respond(embed=PullRequestSubscriptionSuccess(ctx.channel.name, repo))
         else:
             await ctx.respond(embed=HelpEmbed('Channel Already Subscribed',
@@ -210,24 +365,23 @@ class GitHubCog(commands.Cog):
 
         if repo == '':
             await ctx.respond(embed=UsageMessage('/github issues subscribe <REPO_NAME>'))
-            if not repos.get(server):  # no repos added yet
+            if not subscriptions.guild_repos(server):  # no repos added yet
                 await ctx.respond(embed=HelpEmbed('No Repositories Added',
                                                   'You haven\'t added any repositories to CollabyBot yet. '
                                                   'Use /github repo add <REPO_OWNER>/<REPO_NAME> to add one.'))
             else:
                 repo_list = ''
-                for r in repos[server].keys():
+                for r in subscriptions.guild_repos(server):
                     repo_list += f'{r}\n'
                 await ctx.respond(
                     'Subscribe to one of the following added repositories using **/gh-issues <REPO_NAME>**:',
                     embed=HelpEmbed('Available Repositories', repo_list))
 
-        elif repo not in repos[server].keys():  # repo hasn't been added yet
+        elif not subscriptions.has_repo(server, repo):  # repo hasn't been added yet
             await ctx.respond(embed=HelpEmbed('Repo Not Added',
                                               f'Repository {repo} hasn\'t been added to CollabyBot yet. '
                                               f'Use /github repo add <REPO_OWNER>/<REPO_NAME> to add it.'))
-        elif channel not in issue_subscribers[repo]:  # channel isn't subscribed
-            issue_subscribers[repo].append(channel)
+        elif subscriptions.subscribe(server, channel, repo, ISSUE):  # channel wasn't subscribed yet
             await ctx.respond(embed=IssueSubscriptionSuccess(ctx.channel.name, repo))
 
         else:  # channel is already subscribed
@@ -239,11 +393,10 @@ class GitHubCog(commands.Cog):
     async def issues_unsub(self, ctx: discord.ApplicationContext, repo_name=''):
         if repo_name == '':
             await ctx.respond(UsageMessage('/github unsubscribe issues <REPO_OWNER>/<REPO_NAME>'))
-        elif issue_subscribers.get(repo_name) is None:
+        elif not subscriptions.unsubscribe(str(ctx.channel.id), repo_name, ISSUE):
             await ctx.respond(
                 HelpEmbed('Channel Not Subscribed', f'{ctx.channel.name} is not subscribed to issues for {repo_name}.'))
         else:
-            r = issue_subscribers.pop(repo_name)
             await ctx.respond(discord.Embed(
                 color=discord.Color.green(),
                 title='Success',
@@ -254,11 +407,10 @@ class GitHubCog(commands.Cog):
     async def pull_requests_unsub(self, ctx: discord.ApplicationContext, repo_name=''):
         if repo_name == '':
             await ctx.respond(UsageMessage('/github unsubscribe pull-requests <REPO_OWNER>/<REPO_NAME>'))
-        elif pr_subscribers.get(repo_name) is None:
+        elif not subscriptions.unsubscribe(str(ctx.channel.id), repo_name, PULL_REQUEST):
             await ctx.respond(HelpEmbed('Channel Not Subscribed',
                                         f'{ctx.channel.name} is not subscribed to pull requests for {repo_name}.'))
         else:
-            r = pr_subscribers.pop(repo_name)
             await ctx.respond(discord.Embed(
                 color=discord.Color.green(),
                 title='Success',
@@ -269,11 +421,10 @@ class GitHubCog(commands.Cog):
     async def commits_unsub(self, ctx: discord.ApplicationContext, repo_name=''):
         if repo_name == '':
             await ctx.respond(UsageMessage('/github unsubscribe commits <REPO_OWNER>/<REPO_NAME>'))
-        elif commit_subscribers.get(repo_name) is None:
+        elif not subscriptions.unsubscribe(str(ctx.channel.id), repo_name, PUSH):
             await ctx.respond(HelpEmbed('Channel Not Subscribed',
                                         f'{ctx.channel.name} is not subscribed to commits for {repo_name}.'))
         else:
-            r = commit_subscribers.pop(repo_name)
             await ctx.respond(discord.Embed(
                 color=discord.Color.green(),
                 title='Success',
@@ -286,10 +437,10 @@ class GitHubCog(commands.Cog):
         """
         Add a repository to CollabyBot's list of repositories.
 
-        When a repo is added, its branches are retrieved using the GitHub API via
-        PyGithub's Github class. Subscriber lists for each event type are
-        initialized to empty lists (or a dict of empty lists with branches as keys
-        for commits).
+        When a repo is added, its webhook is installed unless another guild already
+        tracks the repo, and its branches are retrieved using the GitHub API via
+        PyGithub's Github class and stored in the subscription index along with
+        the guild that added the repo.
 
         :param str repo: The full name of the repository to add.
         :return: None
@@ -305,53 +456,31 @@ class GitHubCog(commands.Cog):
                 await ctx.respond(embed=GitHubNotAuthenticatedError(ctx.user.name))
             else:
                 # get repo via pygithub
-                g = Github(token)
-                repo = g.get_repo(repo_name)
+                repo = await github_executor.run(get_repo, token, repo_name)
+
+                def get_branch_names():
+                    return [b.name for b in repo.get_branches()]  # get branches via pygithub
 
-                if repo.full_name in repos.get(server):
+                if subscriptions.has_repo(server, repo.full_name):
                     await ctx.respond(embed=HelpEmbed('Repository Already Added',
                                                       f'{repo.full_name} has already been added.'))
                 else:
                     try:
-                        repo.create_hook(name='web',
-                                         config={'url': f'{HOME_URL}/webhook/commits',
-                                                 'content_type': 'json',
-                                                 },
-                                         events=['push'],
-                                         active=True
-                                         )
-                        repo.create_hook(name='web',
-                                         config={'url': f'{HOME_URL}/webhook/issues',
-                                                 'content_type': 'json',
-                                                 },
-                                         events=['issues'],
-                                         active=True
-                                         )
-                        repo.create_hook(name='web',
-                                         config={'url': f'{HOME_URL}/webhook/pull-request',
-                                                 'content_type': 'json',
-                                                 },
-                                         events=['pull_request'],
-                                         active=True
-                                         )
-                        branches = repo.get_branches()  # get branches via pygithub
-                        brs = [b.name for b in branches]
-                        repos[server][repo.full_name] = brs  # dict entry for repo is list of branches
-                        # initialize all subscriber lists
-                        commit_subscribers[repo.full_name] = {b: [] for b in brs}
-                        pr_subscribers[repo.full_name] = []
-                        issue_subscribers[repo.full_name] = []
+                        brs = await github_executor.run(get_branch_names)
+                        # track the repo first, so a guild removing it meanwhile doesn't delete the shared hook
+                        subscriptions.add_repo(server, repo.full_name, brs)
+                        try:
+                            await github_executor.run(repo_hooks.acquire, repo)
+                        except GithubException as ex:
+                            if ex.status != 422:
+                                subscriptions.remove_repo(server, repo.full_name)
+                            raise
                         await ctx.respond(embed=RepoAddSuccess(repo.full_name))
+                    except RateLimitExceededException:
+                        raise  # reported by cog_command_error
                     except (GithubException, UnknownObjectException) as ex:
                         if ex.status == 422:
                             await ctx.respond(embed=GitHub422Error(repo.full_name, ctx.guild.name))
-                            branches = repo.get_branches()  # get branches via pygithub
-                            brs = [b.name for b in branches]
-                            repos[server][repo.full_name] = brs  # dict entry for repo is list of branches
-                            # initialize all subscriber lists
-                            commit_subscribers[repo.full_name] = {b: [] for b in brs}
-                            pr_subscribers[repo.full_name] = []
-                            issue_subscribers[repo.full_name] = []
                             await ctx.respond(embed=RepoAddSuccess(repo.full_name))
                         elif ex.status == 403:
                             await ctx.respond(embed=GitHub403Error(ex.data['message']))
@@ -364,23 +493,25 @@ class GitHubCog(commands.Cog):
         server = str(ctx.guild.id)
         if repo == '':
             await ctx.respond(embed=UsageMessage('/github repo remove <REPO_OWNER>/<REPO_NAME>'))
-        elif repos.get(server).get(repo) is None:
+        elif not subscriptions.remove_repo(server, repo):
             await ctx.respond(embed=HelpEmbed('Repo Not Added', f'{repo} has not been added to {ctx.guild.name}'))
         else:
-            r = repos.pop(repo)
-            if commit_subscribers.get(repo) is not None:
-                r = commit_subscribers.pop(repo)
-            if issue_subscribers.get(repo) is not None:
-                r = issue_subscribers.pop(repo)
-            if pr_subscribers.get(repo) is not None:
-                r = pr_subscribers.pop(repo)
-
+            message = f'{repo} has been removed from {ctx.guild.name}.'
+            token = gh_tokens.get(str(ctx.author.id))
+            if not subscriptions.repo_guilds(repo) and repo_hooks.hook_id(repo) is not None:
+                # this was the last guild tracking the repo, so its webhook goes too
+                deleted = False
+                if token is not None:
+                    try:
+                        deleted = await github_executor.run(repo_hooks.release, token, repo)
+                    except GithubException as ex:
+                        print(f'Could not delete the webhook of {repo}: {ex}')
+                if not deleted:
+                    message += (' Its webhook could not be deleted (that takes admin access to the repository), '
+                                'so it will have to be removed manually on GitHub.')
             await ctx.respond(embed=discord.Embed(color=discord.Color.green(),
                                                   title='Success',
-                                                  description=(
-                                                      f'{repo} has been removed from {ctx.channel.name}, but webhooks '
-                                                      f'will have to be removed from the repository manually on GitHub.'))
-                              )
+                                                  description=message))
 
     @github.command(name='repos', description='See the list of repos added to CollabyBot.')
     @guild_only()
@@ -393,13 +524,13 @@ class GitHubCog(commands.Cog):
 
         server = str(ctx.guild_id)
 
-        if not repos.get(server):
+        if not subscriptions.guild_repos(server):
             await ctx.respond(embed=HelpEmbed('No Repositories Added',
                                               'You haven\'t added any repositories to CollabyBot yet. '
                                               'Use **/github repo add <REPO_OWNER>/<REPO_NAME>** to add one.'))
         else:
             repo_list = ''
-            for r in repos[server].keys():
+            for r in subscriptions.guild_repos(server):
                 repo_list += f'{r}\n'
             list_embed = discord.Embed(color=discord.Color.blurple(),
                                        title=f'Current repositories:',
@@ -427,34 +558,33 @@ class GitHubCog(commands.Cog):
 
         if repo == '':
             await ctx.respond(embed=UsageMessage('/github commits subscribe <REPO_NAME> [BRANCH_NAME]'))
-            if not repos.get(server):
+            if not subscriptions.guild_repos(server):
                 await ctx.respond(embed=HelpEmbed('No Repositories Added',
                                                   'You haven\'t added any repositories to CollabyBot yet. '
                                                   'Use **/github repo add <REPO_OWNER>/<REPO_NAME>** to add one.'))
             else:
                 repo_list = ''
-                for r in repos[server].keys():
+                for r in subscriptions.guild_repos(server):
                     repo_list += f'{r}\n'
                 await ctx.respond('Subscribe to one of the following added repositories '
                                   'using **/gh-commits <REPO_NAME> [BRANCH_NAME]**:',
                                   embed=HelpEmbed('Available Repositories', repo_list))
-        elif repo not in repos[server].keys():
+        elif not subscriptions.has_repo(server, repo):
             await ctx.respond(embed=HelpEmbed('Repo Not Added',
                                               f'Repository {repo} hasn\'t been added to CollabyBot yet. '
                                               f'Use **/github repo add <REPO_OWNER>/<REPO_NAME>** to add it.'))
+        elif branch != '' and branch not in subscriptions.branches(repo):
+            await ctx.respond(embed=HelpEmbed('Branch Not Found', f'{repo} has no branch named {branch}.'))
         else:
             if branch == '':
-                for b in repos[server].get(repo):
-                    if channel not in commit_subscribers[repo][b]:
-                        commit_subscribers[repo][b].append(channel)
-                        await ctx.respond(embed=CommitSubscriptionSuccess(ctx.channel.name, repo, branch))
-                    else:
-                        await ctx.respond(embed=HelpEmbed('Channel Already Subscribed',
-                                                          f'#{ctx.channel.name} is already subscribed to commits for '
-                                                          f'{repo} on {branch}.'))
+                if subscriptions.subscribe(server, channel, repo, PUSH, ALL_BRANCHES):
+                    await ctx.respond(embed=CommitSubscriptionSuccess(ctx.channel.name, repo, 'all branches'))
+                else:
+                    await ctx.respond(embed=HelpEmbed('Channel Already Subscribed',
+                                                      f'#{ctx.channel.name} is already subscribed to commits for '
+                                                      f'{repo} on all branches.'))
             else:
-                if channel not in commit_subscribers[repo][branch]:
-                    commit_subscribers[repo][branch].append(channel)
+                if subscriptions.subscribe(server, channel, repo, PUSH, branch):
                     await ctx.respond(embed=CommitSubscriptionSuccess(ctx.channel.name, repo, branch))
                 else:
                     await ctx.respond(embed=HelpEmbed('Channel Already Subscribed',
@@ -467,8 +597,9 @@ class GitHubCog(commands.Cog):
         """
         Get a list of a repository's open pull requests.
 
-        Connect to a public repository using a Github object, then get all of the repo's
-        open PRs and format them as a list with links and send it as a Discord embed.
+        Get a handle for the repository without fetching it, then page through the
+        repo's open PRs with a LazyPaginator, which only fetches a page of PRs from
+        GitHub when the user gets close to it.
 
         :param repo: The repository to get PRs from.
         :return: None
@@ -480,36 +611,37 @@ class GitHubCog(commands.Cog):
             await ctx.respond(GitHubNotAuthenticatedError(ctx.user.name))
         elif repo == '':
             await ctx.respond(embed=UsageMessage('/github fetch issues <REPO_OWNER>/<REPO_NAME>'))
-        elif repos.get(server).get(repo) is None:
+        elif not subscriptions.has_repo(server, repo):
             await ctx.respond(embed=HelpEmbed('Repo Not Added', f'{repo} has not been added to {ctx.guild.name}.'))
         else:
-            pages = []
-            embeds = []
-            # get repo via pygithub
-            g = Github(token)
-            repo = g.get_repo(repo)
-            # get open(active) PR
-            pulls = repo.get_pulls(state='open')
-            for i in range(0, pulls.totalCount):
-                embeds.append(discord.Embed(title=pulls[i].title, color=discord.Color.blurple()))
-                embeds[i].add_field(name='Number', value=pulls[i].number, inline=True)
-                embeds[i].add_field(name='Author', value=pulls[i].user.login, inline=True)
-                embeds[i].add_field(name='URL', value=pulls[i].html_url, inline=True)
-                embeds[i].add_field(name='Created At', value=pulls[i].created_at.strftime("%m/%d/%Y, %H:%M:%S"),
+            # the repo is only used to build the pulls URL, so don't fetch it
+            pulls = get_repo(token, repo, lazy=True).get_pulls(state='open')
+
+            def render_batch(batch, offset):
+                pages = []
+                for i, pull in enumerate(pulls.get_page(batch), start=offset + 1):
+                    embed = discord.Embed(title=pull.title, color=discord.Color.blurple())
+                    embed.add_field(name='Number', value=pull.number, inline=True)
+                    embed.add_field(name='Author', value=pull.user.login, inline=True)
+                    embed.add_field(name='URL', value=pull.html_url, inline=True)
+                    embed.add_field(name='Created At', value=pull.created_at.strftime("%m/%d/%Y, %H:%M:%S"),
                                     inline=True)
-                embeds[i].add_field(name='Base', value=pulls[i].base.ref, inline=True)
-                embeds[i].add_field(name='Head', value=pulls[i].head.ref, inline=True)
-                embeds[i].add_field(name='Body', value=pulls[i].body, inline=False)
-                pages.append(Page(
-                    content=f'PR #{i + 1} of {pulls.totalCount} in **{repo.full_name}**):',
-                    embeds=[embeds[i]])
-                )
-            if pages:
-                paginator = Paginator(pages=pages)
+                    embed.add_field(name='Base', value=pull.base.ref, inline=True)
+                    embed.add_field(name='Head', value=pull.head.ref, inline=True)
+                    embed.add_field(name='Body', value=pull.body, inline=False)
+                    pages.append(Page(content=f'PR #{i} in **{repo}**:', embeds=[embed]))
+                return pages
+
+            async def fetch_batch(batch, offset, background=False):
+                run = github_executor.run_background if background else github_executor.run
+                return await run(render_batch, batch, offset)
+
+            paginator = await LazyPaginator.load(fetch_batch, GITHUB_PER_PAGE)
+            if paginator is not None:
                 await paginator.respond(ctx.interaction, ephemeral=False)
             else:
                 await ctx.respond(
-                    embed=HelpEmbed('No Issues Found', f'{repo.full_name} currently has no open pull requests.'))
+                    embed=HelpEmbed('No Issues Found', f'{repo} currently has no open pull requests.'))
 
     @fetch.command(name='issues', description='Get a list of open issues in a repository.')
     @guild_only()
@@ -517,8 +649,9 @@ class GitHubCog(commands.Cog):
         """
         Get a list of a repository's open issues.
 
-        Connect to a public repository using a Github object, then get all of the repo's
-        open issues and format them as a list with links and send it as a Discord embed.
+        Get a handle for the repository without fetching it, then page through the
+        repo's open issues with a LazyPaginator, which only fetches a page of issues
+        from GitHub when the user gets close to it.
 
         :param repo: The repository to get issues from.
         :return: None
@@ -530,34 +663,34 @@ class GitHubCog(commands.Cog):
             await ctx.respond(GitHubNotAuthenticatedError(ctx.user.name))
         elif repo == '':
             await ctx.respond(embed=UsageMessage('/github fetch issues <REPO_OWNER>/<REPO_NAME>'))
-        elif repos.get(server).get(repo) is None:
+        elif not subscriptions.has_repo(server, repo):
             await ctx.respond(embed=HelpEmbed('Repo Not Added', f'{repo} has not been added to {ctx.guild.name}.'))
         else:
-            pages = []
-            embeds = []
-            # get repo via pygithub
-            g = Github(token)
-            repo = g.get_repo(repo)
-            # get open(active) PR
-            issues = repo.get_issues(state='open')
-
-            for i in range(0, issues.totalCount):
-                embeds.append(discord.Embed(title=issues[i].title, color=discord.Color.blurple()))
-                embeds[i].add_field(name='Number', value=issues[i].number, inline=True)
-                embeds[i].add_field(name='Author', value=issues[i].user.login, inline=True)
-                embeds[i].add_field(name='URL', value=issues[i].html_url, inline=True)
-                embeds[i].add_field(name='Created At', value=issues[i].created_at.strftime("%m/%d/%Y, %H:%M:%S"),
+            # the repo is only used to build the issues URL, so don't fetch it
+            issues = get_repo(token, repo, lazy=True).get_issues(state='open')
+
+            def render_batch(batch, offset):
+                pages = []
+                for i, issue in enumerate(issues.get_page(batch), start=offset + 1):
+                    embed = discord.Embed(title=issue.title, color=discord.Color.blurple())
+                    embed.add_field(name='Number', value=issue.number, inline=True)
+                    embed.add_field(name='Author', value=issue.user.login, inline=True)
+                    embed.add_field(name='URL', value=issue.html_url, inline=True)
+                    embed.add_field(name='Created At', value=issue.created_at.strftime("%m/%d/%Y, %H:%M:%S"),
                                     inline=True)
-                embeds[i].add_field(name='Body', value=issues[i].body, inline=False)
-                pages.append(Page(
-                    content=f'Issue #{i + 1} of {issues.totalCount} in **{repo.full_name}**:',
-                    embeds=[embeds[i]])
-                )
-            if pages:
-                paginator = Paginator(pages=pages)
+                    embed.add_field(name='Body', value=issue.body, inline=False)
+                    pages.append(Page(content=f'Issue #{i} in **{repo}**:', embeds=[embed]))
+                return pages
+
+            async def fetch_batch(batch, offset, background=False):
+                run = github_executor.run_background if background else github_executor.run
+                return await run(render_batch, batch, offset)
+
+            paginator = await LazyPaginator.load(fetch_batch, GITHUB_PER_PAGE)
+            if paginator is not None:
                 await paginator.respond(ctx.interaction, ephemeral=False)
             else:
-                await ctx.respond(embed=HelpEmbed('No Issues Found', f'{repo.full_name} currently has no open issues.'))
+                await ctx.respond(embed=HelpEmbed('No Issues Found', f'{repo} currently has no open issues.'))
 
     @issues.command(name='close', description='Close an issue.')
     @guild_only()
@@ -570,13 +703,15 @@ class GitHubCog(commands.Cog):
         elif repo == '' or issue_id == '':
             await ctx.respond(
                 embed=UsageMessage('/github issue close <REPO_OWNER>/<REPO_NAME> <ISSUE_NUMBER> [COMMENT]'))
-        elif repos.get(server).get(repo) is None:
+        elif not subscriptions.has_repo(server, repo):
             await ctx.respond(embed=HelpEmbed('Repo Not Added', f'{repo} has not been added to {ctx.guild.name}.'))
         else:
-            g = Github(token)
-            r = g.get_repo(repo)
-            issue = r.get_issue(int(issue_id))
-            issue.edit(state='closed')
+            def close_issue():
+                issue = get_issue(token, repo, int(issue_id))
+                issue.edit(state='closed')
+                return issue
+
+            issue = await github_executor.run(close_issue)
 
             await ctx.respond(embed=discord.Embed(
                 color=discord.Color.green(),
@@ -594,14 +729,17 @@ class GitHubCog(commands.Cog):
         elif repo == '' or issue_id == '' or assignees == '':
             await ctx.respond(
                 embed=UsageMessage('/github issue assign <REPO_OWNER>/<REPO_NAME> <ISSUE_NUMBER> <ASSIGNEE(S)>'))
-        elif repos.get(server).get(repo) is None:
+        elif not subscriptions.has_repo(server, repo):
             await ctx.respond(embed=HelpEmbed('Repo Not Added', f'{repo} has not been added to {ctx.guild.name}'))
         else:
-            g = Github(token)
-            r = g.get_repo(repo)
-            issue = r.get_issue(int(issue_id))
             assignee_list = assignees.split(' ')
-            issue.edit(assignees=assignee_list)
+
+            def assign_issue():
+                issue = get_issue(token, repo, int(issue_id))
+                issue.edit(assignees=assignee_list)
+                return issue
+
+            issue = await github_executor.run(assign_issue)
 
             await ctx.respond(f'Issue {issue.title} has been assigned to {", ".join(assignee_list)}.')
 
@@ -615,18 +753,20 @@ class GitHubCog(commands.Cog):
             await ctx.respond(GitHubNotAuthenticatedError(ctx.user.name))
         elif repo == '':
             await ctx.respond(embed=UsageMessage('/github pull-request <REPO_OWNER>/<REPO_NAME> <PR_ID> [COMMENT]'))
-        elif repos.get(server).get(repo) is None:
+        elif not subscriptions.has_repo(server, repo):
             await ctx.respond(embed=HelpEmbed('Repo Not Added', f'{repo} has not been added to {ctx.guild.name}'))
         else:
-            g = Github(token)
-            r = g.get_repo(repo)
-            pr = r.get_pull(int(pr_id))
-            pr.create_review(body=comment, event='APPROVE')
+            def approve_pull_request():
+                pr = get_pull(token, repo, int(pr_id))
+                pr.create_review(body=comment, event='APPROVE')
+                return pr
+
+            pr = await github_executor.run(approve_pull_request)
 
             await ctx.respond(embed=discord.Embed(
                 color=discord.Color.green(),
                 title='Success',
-                description=f'{pr.title} has been approved.')
+                description=f'PR #{pr.number} in {repo} has been approved.')
             )
 
     @github.command(name='auth', description='Authenticate with the CollabyBot OAuth app for full access to GitHub '
@@ -641,6 +781,7 @@ class GitHubCog(commands.Cog):
         else:
             await queue_lock.acquire()
             user = ctx.author
+            gh_token_owners.link(str(ctx.guild_id), user_id)
             auth_queue.put(user_id)
             await user.send('Click here to authorize CollabyBot to access GitHub repositories on your behalf.',
                             view=AuthButton())
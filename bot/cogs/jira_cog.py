@@ -1,34 +1,36 @@
 import asyncio
+import io
 import json
 import os
+import aiohttp
 import discord
-import requests
 from discord import Guild, Member, guild_only
 from discord.ext import commands
 from discord.ext.commands import Context
 from discord.ext.pages import Page, Paginator
 from jira import JIRA, JIRAError
-from os import remove, getenv
+from os import getenv
 from datetime import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
 from queue import Queue
 from bot.embeds import JiraExpiredTokenError, JiraNotAuthenticatedError, JiraAuthSuccess, HelpEmbed, UsageMessage, \
-    JiraUserError, IssueAssignSuccess, JiraInstanceNotFoundError
+    JiraUserError, IssueAssignSuccess, JiraInstanceNotFoundError, JiraLookupError
+from bot.utils.burndown import burndown, burndown_charts, sprint_fingerprint, sprint_id
+from bot.utils.state_store import state_store, StoredDict
+from bot.utils.jira_client import assign_issue, assignable_users, jira_clients, jira_executor, jira_resources, \
+    search_all_issues
+from bot.utils.token_owners import TokenOwnerIndex
+
+# Only the fields /jira sprint shows, plus story points, sprint and resolution date for the burndown chart
+SPRINT_FIELDS = ['summary', 'description', 'assignee', 'status', 'resolutiondate',
+                 'customfield_10026', 'customfield_10020']
 
-JIRA_RESOURCES_ENDPOINT = os.getenv('JIRA_RESOURCES_ENDPOINT')
 JIRA_API_URL = os.getenv('JIRA_API_URL')
 HOME_URL = os.getenv('HOME_URL')
 
-# with open('bot/cogs/json_/jira_tokens.json') as f:
-#     jira_tokens = json.load(f)  # channel ids of channels subscribed to issues
-#     f.close()
-# with open('bot/cogs/json_/jira_sites.json') as f:
-#     jira_sites = json.load(f)  # channel ids of channels subscribed to issues
-#     f.close()
-
-jira_tokens = {}
-jira_sites = {}
+# State is loaded from the state store once at startup and written back to it in the background
+jira_tokens = StoredDict(state_store, 'jira_tokens')
+jira_sites = StoredDict(state_store, 'jira_sites')
+jira_token_owners = TokenOwnerIndex(state_store, 'jira_token_owners')  # guilds each token owner uses the bot in
 
 auth_queue = Queue(maxsize=1)
 queue_lock = asyncio.Lock()
@@ -43,11 +45,22 @@ class JiraCog(commands.Cog):
         self.bot = bot
         self.auth_queue_users = Queue(maxsize=5)
 
+    async def cog_after_invoke(self, ctx: discord.ApplicationContext):
+        """
+        Link the user who ran a command to the guild, if they have a token.
+
+        :return: None
+        """
+
+        if ctx.guild_id is not None and str(ctx.author.id) in jira_tokens:
+            jira_token_owners.link(str(ctx.guild_id), str(ctx.author.id))
+
     @commands.Cog.listener()
     async def on_guild_remove(self, guild: Guild):
         """
         Delete existing records of guild and its members when the guild is deleted or the
-        bot is removed.
+        bot is removed. Tokens are only deleted for users who don't use the bot in any
+        other guild.
 
         Parameters
         ----------
@@ -58,15 +71,15 @@ class JiraCog(commands.Cog):
         None
         """
 
-        user = str(guild.id)
-        members = guild.members
+        server = str(guild.id)
 
-        for user in members:
-            if jira_tokens.get(str(user.id)) is not None:
-                jira_tokens.pop(str(user.id))
+        for user in jira_token_owners.remove_guild(server):
+            if jira_tokens.get(user) is not None:
+                token = jira_tokens.pop(user)[0]
+                jira_clients.invalidate(token)
+                jira_resources.invalidate(token)
 
-        if jira_sites.get(user) is not None:
-            jira_sites.pop(user)
+        jira_sites.pop(server, None)
 
     @commands.Cog.listener()
     async def on_member_remove(self, member: Member):
@@ -85,95 +98,11 @@ class JiraCog(commands.Cog):
         user = str(member.id)
 
         if jira_tokens.get(user) is not None:
-            jira_tokens.pop(user)
+            token = jira_tokens.pop(user)[0]
+            jira_clients.invalidate(token)
+            jira_resources.invalidate(token)
+        jira_token_owners.remove_user(user)
 
-        # self.save_dicts()
-
-    # def save_dicts(self):
-    #     with open('bot/cogs/json_/jira_tokens.json', 'w') as f:
-    #         json.dump(jira_tokens, f)  # channel ids of channels subscribed to issues
-    #         f.close()
-    #     with open('bot/cogs/json_/jira_sites.json', 'w') as f:
-    #         json.dump(jira_sites, f)  # channel ids of channels subscribed to issues
-    #         f.close()
-
-    def burndown(self, jira, issues):
-        """
-        Utility method used by the /sprint command for creating a burndown chart.
-
-        First add up all the story points in the sprint, issue by issue. Then calculate
-        how many points remain for each day in the sprint by comparing issue's resolution date
-        to each date in the sprint's timespan. Plot the remaining points vs. date by storing them
-        in a dictionary and plotting the line.
-
-        Also plot the guideline by finding the slope that creates a linear decline from
-        start to end of the sprint.
-
-        Return the filename of the newly created burndown chart so that Discord can open it.
-
-        :param jira: The instance of the Jira class being used by the /sprint command
-        :param issues: Collection of sprint issues retrieved by the Jira class instance
-        :return str: Filename of the newly created burndown chart
-        """
-
-        total_points = 0
-        for i in issues:
-            if i.raw['fields'].get('customfield_10026') is not None:
-                total_points += int(i.raw['fields']['customfield_10026'])
-            else:
-                total_points += 0
-            sprint_id = i.raw['fields']['customfield_10020'][0]['id']
-
-        # Get start and end date of sprint
-        sprint = jira.sprint(sprint_id)
-        start = sprint.raw['startDate'].split('T')[0]
-        end = sprint.raw['endDate'].split('T')[0]
-
-        # Timespan of sprint
-        date_range = pd.date_range(start=start, end=end, freq='D', inclusive='left')
-
-        remaining_points = {}
-        for d in date_range:
-            remaining = total_points
-            for i in issues:
-                # TODO: Replace exception with if-else checking for a None story points custom field
-                try:
-                    # Remove issue's story points from remaining if its resolution date
-                    # is before/on current date in sprint timespan
-                    if i.fields.resolutiondate.split('T')[0] <= d.strftime('%Y-%m-%d'):
-                        if i.raw['fields'].get('customfield_10026') is not None:
-                            remaining -= int(i.raw['fields']['customfield_10026'])
-                        else:
-                            remaining -= 0
-                except AttributeError:
-                    pass
-            remaining_points[d.strftime('%Y-%m-%d')] = int(remaining)  # Put remaining points value in date/points dict
-
-        slope = -total_points / (
-                len(remaining_points.keys()) - 1)  # get slope of ideal pace for guideline (linear decline)
-
-        # Create guideline
-        guideline = {}
-        for i, k in zip(range(0, len(remaining_points.keys())), remaining_points.keys()):
-            guideline[k] = (slope * i) + total_points  # should be a straight line
-
-        # Plot chart
-        fig = plt.figure(figsize=(12, 4))
-        plt.step(remaining_points.keys(), remaining_points.values(), 'r-', label='Remaining Story Points', where='post')
-        plt.plot(guideline.keys(), guideline.values(), color='grey', label='Guideline')
-        plt.xlim([min(remaining_points.keys()), max(remaining_points.keys())])
-        plt.ylim([0, total_points + 1])
-        plt.xlabel('Date')
-        plt.ylabel('Story Points')
-        plt.legend()
-        plt.title('Burndown Chart for Sprint \"{0}\" '.format(sprint.raw['name']))
-        plt.gcf().autofmt_xdate()
-        # Create filename using current date
-        filename = 'burndown-' + datetime.now().strftime('%Y-%m-%d') + '-' + str(sprint.raw['id']) + '.jpg'
-        # Save the plot locally
-        plt.savefig(filename)
-        # Return the filename
-        return filename
 
     @issue.command(name='get', description='Get summary, description, issue type, and assignee of a Jira issue.')
     @guild_only()
@@ -203,14 +132,8 @@ class JiraCog(commands.Cog):
         elif datetime.strptime(token[1], "%Y-%m-%d %H:%M:%S") < datetime.now():
             await ctx.respond(embed=JiraExpiredTokenError(ctx.user.name))
         else:
-            options = {
-                'server': f'{JIRA_API_URL}/{site[1]}',
-                'headers': {
-                    'Authorization': f'Bearer {token[0]}'
-                }
-            }
-            jira = JIRA(options=options)
-            issue = jira.issue(issue_id)
+            jira = await jira_executor.run(jira_clients.get, site[1], token[0])
+            issue = await jira_executor.run(jira.issue, issue_id)
 
             embed = discord.Embed(color=discord.Color.blurple(), title=issue_id)
             embed.add_field(name=f'Summary:', value=issue.fields.summary, inline=False)
@@ -284,29 +207,17 @@ class JiraCog(commands.Cog):
         # No args
         elif project_id == '':
             await ctx.respond(embed=UsageMessage('/jira sprint <PROJECT_ID>'))
-            options = {
-                'server': f'{JIRA_API_URL}/{site[1]}',
-                'headers': {
-                    'Authorization': f'Bearer {token[0]}'
-                }
-            }
-            jira = JIRA(options=options)
+            jira = await jira_executor.run(jira_clients.get, site[1], token[0])
             embed = discord.Embed(color=discord.Color.yellow(), title="Available Projects")
-            projects = jira.projects()
+            projects = await jira_executor.run(jira.projects)
             for project in projects:
                 embed.add_field(name=project.name, value=f'Project ID: {project.id}', inline=False)
             await ctx.respond(embed=embed)
         else:
-            options = {
-                'server': f'{JIRA_API_URL}/{site[1]}',
-                'headers': {
-                    'Authorization': f'Bearer {token[0]}'
-                }
-            }
-            jira = JIRA(options=options)
+            jira = await jira_executor.run(jira_clients.get, site[1], token[0])
             # Find issues from the project's current sprint using JQL query
             query = 'project={0} AND SPRINT not in closedSprints() AND sprint not in futureSprints()'.format(project_id)
-            issues = jira.search_issues(query)
+            issues = await search_all_issues(jira, query, SPRINT_FIELDS)
 
             # TODO: Move to utils
             def divide_chunks(l, n):
@@ -318,9 +229,8 @@ class JiraCog(commands.Cog):
             pages = []
             for i in range(0, len(issue_chunks)):
                 embeds.append(discord.Embed(color=discord.Color.blurple(), title='Active Sprint'))
-                for issue_name in issue_chunks[i]:
-                    issue = jira.issue(issue_name)
-                    embeds[i].add_field(name=f'Name:', value=issue_name, inline=False)
+                for issue in issue_chunks[i]:
+                    embeds[i].add_field(name=f'Name:', value=issue.key, inline=False)
                     embeds[i].add_field(name=f'Summary:', value=issue.fields.summary, inline=False)
                     embeds[i].add_field(name=f'Description:', value=issue.fields.description, inline=False)
                     if issue.fields.assignee is None:
@@ -337,11 +247,15 @@ class JiraCog(commands.Cog):
             await paginator.respond(ctx.interaction, ephemeral=False)
 
             # Create burndown chart
-            burndown_chart = self.burndown(jira, issues)
-            with open(burndown_chart, 'rb') as f:
-                picture = discord.File(f)
-                await ctx.respond('**Burndown Chart:**', file=picture)
-            remove(burndown_chart)  # Delete chart after sending it
+            current_sprint = sprint_id(issues)
+            chart_key = (site[1], current_sprint, sprint_fingerprint(issues))
+            burndown_chart = burndown_charts.get(chart_key)
+            if burndown_chart is None:  # sprint changed since the chart was last drawn
+                sprint = await jira_executor.run(jira.sprint, current_sprint)
+                burndown_chart = await burndown(sprint, issues)
+                burndown_charts.put(chart_key, burndown_chart)
+            picture = discord.File(io.BytesIO(burndown_chart), filename=f'burndown-{current_sprint}.png')
+            await ctx.respond('**Burndown Chart:**', file=picture)
 
     @issue.command(name='assign', description='Assign a Jira issue to a user.')
     @guild_only()
@@ -398,22 +312,16 @@ class JiraCog(commands.Cog):
                         yield l[i:i + n]
 
                 project_name = issue_id.split('-')[0]
-                options = {
-                    'server': f'{JIRA_API_URL}/{site[1]}',
-                    'headers': {
-                        'Authorization': f'Bearer {token[0]}'
-                    }
-                }
-                jira = JIRA(options=options)
-                users = jira.search_assignable_users_for_projects('', project_name, maxResults=500)
-                user_chunks = list(divide_chunks(users, 12))
+                jira = await jira_executor.run(jira_clients.get, site[1], token[0])
+                users = await assignable_users.get(jira, site[1], project_name)
+                user_chunks = list(divide_chunks(users.users, 12))
 
                 embeds = []
                 pages = []
                 for i in range(0, len(user_chunks)):
                     embeds.append(discord.Embed(color=discord.Color.yellow(), title='Assignable Users'))
-                    for user in user_chunks[i]:
-                        embeds[i].add_field(name=user.displayName, value=user.accountId, inline=False)
+                    for account_id, display_name in user_chunks[i]:
+                        embeds[i].add_field(name=display_name, value=account_id, inline=False)
                     pages.append(Page(
                         content=f'Available assignees (Part {i + 1}):',
                         embeds=[embeds[i]])
@@ -421,27 +329,15 @@ class JiraCog(commands.Cog):
                 paginator = Paginator(pages=pages)
                 await paginator.respond(ctx.interaction, ephemeral=False)
             else:
-                options = {
-                    'server': f'{JIRA_API_URL}/{site[1]}',
-                    'headers': {
-                        'Authorization': f'Bearer {token[0]}'
-                    }
-                }
-                jira = JIRA(options=options)
+                jira = await jira_executor.run(jira_clients.get, site[1], token[0])
                 project_name = issue_id.split('-')[0]
-                users_dict = {}
-                # TODO: Deal with max results
-                users = jira.search_assignable_users_for_projects('', project_name, maxResults=200)
-
-                for user in users:
-                    users_dict[user.accountId] = user.displayName
-
-                if user_id[0].isnumeric():  # account ID
-                    user_name = users_dict.get(user_id)
-                else:  # Given name
-                    user_name = user_id
+                account = await self.find_assignee(jira, site[1], project_name, user_id)
+                if account is None:
+                    await ctx.respond(embed=JiraUserError(user_id))
+                    return
+                account_id, user_name = account
 
-                issue = jira.issue(issue_id)
+                issue = await jira_executor.run(jira.issue, issue_id, fields='assignee')
                 if issue.fields.assignee is not None:
                     await ctx.respond(
                         f'{issue_id} is already assigned to {issue.fields.assignee}. Reassign to {user_name}?')
@@ -449,7 +345,7 @@ class JiraCog(commands.Cog):
                     if response.content in ['yes', 'Yes', 'y', 'Y']:
                         # TODO: Switch to some other kind of error checking?
                         try:
-                            jira.assign_issue(issue_id, user_name)
+                            await jira_executor.run(assign_issue, jira, issue_id, account_id)
                             await ctx.respond(embed=IssueAssignSuccess(issue_id, user_name))
                         except JIRAError:
                             await ctx.respond(embed=JiraUserError(user_name))
@@ -457,11 +353,37 @@ class JiraCog(commands.Cog):
                         await ctx.send(f'{issue_id} will not be reassigned to {user_name}.')
                 else:
                     try:
-                        jira.assign_issue(issue_id, user_name)
+                        await jira_executor.run(assign_issue, jira, issue_id, account_id)
                         await ctx.respond(embed=IssueAssignSuccess(issue_id, user_name))
                     except JIRAError:
                         await ctx.respond(embed=JiraUserError(user_name))
 
+    async def find_assignee(self, jira: JIRA, site_id: str, project: str, user: str):
+        """
+        Look up a user in a project's assignable users by account ID or display name.
+
+        If the user isn't found, the cached users may predate them joining the
+        project, so they are fetched again once before giving up.
+
+        :param JIRA jira: The client to fetch the users with.
+        :param str site_id: Cloud ID of the Jira site.
+        :param str project: Key of the project.
+        :param str user: Account ID or (the start of) the display name of the user.
+        :return tuple: The account ID and display name, or None if no assignable user matches.
+        """
+
+        for attempt in range(2):
+            if attempt:
+                assignable_users.invalidate(site_id, project)
+            users = await assignable_users.get(jira, site_id, project)
+            name = users.get(user)
+            if name is not None:
+                return user, name
+            matches = users.find(user)
+            if matches:
+                return matches[0]
+        return None
+
     @issue.command(name='unassign', description='Unassign a Jira issue.')
     @guild_only()
     async def jira_unassign_issue(self, ctx: discord.ApplicationContext, issue_id=''):
@@ -488,14 +410,8 @@ class JiraCog(commands.Cog):
             if issue_id == '':
                 await ctx.respond(embed=UsageMessage('/jira unassign <ISSUE_ID>'))
             else:
-                options = {
-                    'server': f'{JIRA_API_URL}/{site[1]}',
-                    'headers': {
-                        'Authorization': f'Bearer {token[0]}'
-                    }
-                }
-                jira = JIRA(options=options)
-                jira.assign_issue(issue_id, None)
+                jira = await jira_executor.run(jira_clients.get, site[1], token[0])
+                await jira_executor.run(jira.assign_issue, issue_id, None)
                 await ctx.respond(embed=discord.Embed(
                     color=discord.Color.green(),
                     title='Success',
@@ -514,6 +430,7 @@ class JiraCog(commands.Cog):
         else:
             await queue_lock.acquire()
             user = ctx.author
+            jira_token_owners.link(str(ctx.guild_id), user_id)
             self.auth_queue_users.put(user_id)
 
             await user.send('Click here to authorize CollabyBot to access the Jira API.',
@@ -523,6 +440,11 @@ class JiraCog(commands.Cog):
     async def jira_add_token(self, token: str, expires: datetime):
         user_id = self.auth_queue_users.get()
         queue_lock.release()
+        old_token = jira_tokens.get(user_id)
+        if old_token is not None:
+            # pooled clients and cached sites still belong to the replaced token
+            jira_clients.invalidate(old_token[0])
+            jira_resources.invalidate(old_token[0])
         jira_tokens[user_id] = (token, expires)
         user = await self.bot.fetch_user(int(user_id))
         await user.send('Authentication complete.')
@@ -542,41 +464,34 @@ class JiraCog(commands.Cog):
         elif datetime.strptime(token[1], "%Y-%m-%d %H:%M:%S") < datetime.now():
             await ctx.respond(embed=JiraExpiredTokenError(ctx.user.name))
         else:
+            # look the instance up before asking to replace the current one, so a missing instance is reported at once
+            try:
+                site = await jira_resources.site(token[0], token[1], instance)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                if getattr(ex, 'status', None) == 401:
+                    await ctx.respond(embed=JiraExpiredTokenError(ctx.user.name))
+                else:
+                    await ctx.respond(embed=JiraLookupError(instance))
+                return
+            if site is None:
+                await ctx.respond(embed=JiraInstanceNotFoundError(instance, ctx.user.name))
             # Instance already exists
-            if jira_sites.get(server) is not None:
+            elif jira_sites.get(server) is not None:
                 await ctx.send(f'This server is already linked to the {jira_sites.get(server)[0]} instance. '
                                f'Replace it with {instance}? (Yes/no)')
                 response = await ctx.bot.wait_for('message', timeout=20.0)
                 if response.content in ['y', 'Y', 'yes', 'Yes']:
-                    r = requests.get(JIRA_RESOURCES_ENDPOINT,
-                                     headers={'Authorization': f'Bearer {token[0]}',
-                                              'Accept': 'application/json'})
-                    for site in r.json():
-                        if site['name'] == instance:
-                            jira_sites[server] = (site['name'], site['id'])
-                            await ctx.respond(embed=JiraAuthSuccess(instance))
-                            break
-                    # Instance was not found in response
-                    if jira_sites.get(server) is None:
-                        await ctx.respond(embed=JiraInstanceNotFoundError(instance, ctx.user.name))
+                    jira_sites[server] = site
+                    await ctx.respond(embed=JiraAuthSuccess(instance))
                 else:
                     await ctx.send(f'The instance will not be changed to {instance}.')
             else:
-                r = requests.get(JIRA_RESOURCES_ENDPOINT,
-                                 headers={'Authorization': f'Bearer {token[0]}',
-                                          'Accept': 'application/json'})
-                for site in r.json():
-                    if site['name'] == instance:
-                        jira_sites[server] = (site['name'], site['id'])
-                        await ctx.respond(embed=discord.Embed(
-                            color=discord.Color.green(),
-                            title='Success',
-                            description=f'You can now use Jira commands to access projects in {instance}!')
-                        )
-                        break
-                # Instance was not found in response
-                if jira_sites.get(server) is None:
-                    await ctx.respond(embed=JiraInstanceNotFoundError(instance, ctx.user.name))
+                jira_sites[server] = site
+                await ctx.respond(embed=discord.Embed(
+                    color=discord.Color.green(),
+                    title='Success',
+                    description=f'You can now use Jira commands to access projects in {instance}!')
+                )
 
     @instance_commands.command(name='get', description='Get the name of the Jira instance currently associated '
                                                        'with this server.')
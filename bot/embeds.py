@@ -49,6 +49,15 @@ class GitHub404Error(Embed):
                          )
 
 
+class GitHubRateLimitError(Embed):
+    def __init__(self, reset: int = None):
+        when = f'<t:{reset}:R>' if reset else 'within the hour'
+        super().__init__(color=Color.red(), title='Rate Limit Exceeded',
+                         description=f'You have used up your GitHub API rate limit. It resets {when}, '
+                                     f'try again after that.'
+                         )
+
+
 class HelpEmbed(Embed):
     def __init__(self, title: str, message: str):
         super().__init__(title=title, color=Color.yellow(), description=message)
@@ -105,3 +114,10 @@ class JiraInstanceNotFoundError(Embed):
     def __init__(self, instance: str, user: str):
         super().__init__(color=Color.red(), title='Instance Not Found',
                          description=f'Could not find Jira instance named {instance} within {user}\'s scope.')
+
+
+class JiraLookupError(Embed):
+    def __init__(self, instance: str):
+        super().__init__(color=Color.red(), title='Lookup Error',
+                         description=f'Could not look up Jira instance {instance} right now, because Atlassian '
+                                     f'didn\'t answer. Try again in a moment.')
@@ -1,25 +1,5 @@
-class Commit:
-    def __init__(self, commit_message, action, repo, timestamp, url, user):
-        self.commit_message = commit_message
-        self.action = action
-        self.repo = repo
-        self.date = timestamp.split('T')[0]
-        self.time = timestamp.split('T')[1][0:-1]
-        self.url = url
-        self.user = user
-
-        # To Do: Check if proper format
-
-    def object_string(self):
-        """
-        Triggered in each object handler. Formats a string to send to the bot.
-
-        :return str: String format of the object and its notification message.
-        """
-
-        notify_message = F'Repository: {self.repo}\nCommit Message: {self.commit_message}\nDate: {self.date}\n' \
-                         F'Time: {self.time}\nAuthor: {self.user}\nURL: {self.url}'
-        return notify_message
+FIELD_VALUE_LIMIT = 1024  # Discord's limit on the length of an embed field's value
+COMMIT_LINE_LIMIT = 100
 
 
 class Issue:
@@ -81,3 +61,86 @@ class PullRequest:
                              F'Reviewer Requested: {self.reviewer_requested}\nDescription: {self.body}\n' \
                              F'Date: {self.date}\nTime: {self.time}\nAuthor: {self.user}\nURL: {self.url}'
             return notify_message
+
+
+class PushDigest:
+    """
+    Summary of every commit in a push, sized to fit in one embed field.
+
+    Each commit gets a line with its short SHA, the first line of its message and
+    its author. Lines are added until the field is full, and the rest are counted
+    in an "...and K more" line. The compare link is always kept, so the full push
+    is one click away however many commits it had.
+    """
+
+    def __init__(self, repo, branch, pusher, commits, compare_url, created=False, deleted=False, forced=False,
+                 head=None):
+        self.repo = repo
+        self.branch = branch
+        self.pusher = pusher
+        self.commits = commits
+        self.compare_url = compare_url
+        self.created = created
+        self.deleted = deleted
+        self.forced = forced
+        self.head = head
+
+    def summary(self):
+        """
+        Describe what the push did to the branch.
+
+        :return str: One line naming the pusher, the branch and the number of commits.
+        """
+
+        if self.deleted:
+            return F'{self.pusher} deleted branch {self.branch}'
+        count = len(self.commits)
+        what = F'{count} commit' + ('' if count == 1 else 's')
+        if self.forced:
+            if not self.commits:
+                return F'{self.pusher} force-pushed {self.branch} to {(self.head or "")[:7]}'
+            return F'{self.pusher} force-pushed {what} to {self.branch}'
+        if self.created:
+            return F'{self.pusher} created branch {self.branch}' + (F' with {what}' if self.commits else '')
+        return F'{self.pusher} pushed {what} to {self.branch}'
+
+    @staticmethod
+    def commit_line(commit):
+        """
+        Format one commit of the push.
+
+        :param dict commit: A commit from the push payload's commits array.
+        :return str: The commit's short SHA, message title and author.
+        """
+
+        title = (commit.get('message') or '').split('\n', 1)[0]
+        author = (commit.get('author') or {}).get('name')
+        line = F'`{commit.get("id", "")[:7]}` {title} - {author}'
+        if len(line) > COMMIT_LINE_LIMIT:
+            line = line[:COMMIT_LINE_LIMIT - 3] + '...'
+        return line
+
+    def object_string(self):
+        """
+        Triggered in each object handler. Formats a string to send to the bot.
+
+        :return str: The digest, no longer than FIELD_VALUE_LIMIT.
+        """
+
+        header = F'Repository: {self.repo}\n{self.summary()}'
+        footer = F'Compare: {self.compare_url}' if self.compare_url and not self.deleted else ''
+        room = FIELD_VALUE_LIMIT - len(header) - len(footer) - 2
+
+        lines = []
+        for i, commit in enumerate(self.commits):
+            line = self.commit_line(commit)
+            more = len(self.commits) - i - 1
+            # keep room for the "...and K more" line unless this is the last commit
+            reserve = len(F'\n...and {more} more') if more else 0
+            if len(line) + 1 + reserve > room:
+                lines.append(F'...and {len(self.commits) - i} more')
+                break
+            lines.append(line)
+            room -= len(line) + 1
+
+        return '\n'.join(part for part in (header, '\n'.join(lines), footer) if part)[:FIELD_VALUE_LIMIT]
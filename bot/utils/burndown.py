@@ -1,81 +1,190 @@
-from datetime import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from bot.utils.cache import LRUCache
 
+STORY_POINTS_FIELD = 'customfield_10026'
+SPRINT_FIELD = 'customfield_10020'
+BURNDOWN_RENDER_WORKERS = int(os.getenv('BURNDOWN_RENDER_WORKERS', 2))
+BURNDOWN_CACHE_SIZE = int(os.getenv('BURNDOWN_CACHE_SIZE', 64))
 
-def burndown(jira, issues):
+_render_pool = None
+
+# Rendered charts keyed by (site id, sprint id, sprint fingerprint)
+burndown_charts = LRUCache(BURNDOWN_CACHE_SIZE)
+
+
+def burndown_series(start, end, points, resolved):
     """
-    Utility method used by the /sprint command for creating a burndown chart.
+    Compute the remaining story points for each day of a sprint.
 
-    First add up all the story points in the sprint, issue by issue. Then calculate
-    how many points remain for each day in the sprint by comparing issue's resolution date
-    to each date in the sprint's timespan. Plot the remaining points vs. date by storing them
-    in a dictionary and plotting the line.
+    Resolution dates are turned into day offsets from the start of the sprint and
+    the points of every resolved issue are binned into the day it was resolved on
+    (issues resolved before the sprint started count towards the first day). The
+    running sum of the bins is subtracted from the sprint's total to get the
+    remaining points, and the guideline is a linear decline from the total to zero.
 
-    Also plot the guideline by finding the slope that creates a linear decline from
-    start to end of the sprint.
+    :param str start: First day of the sprint as YYYY-MM-DD.
+    :param str end: Day the sprint ends as YYYY-MM-DD. The end date itself is not included.
+    :param points: Story points of each issue.
+    :param resolved: Resolution date of each issue as YYYY-MM-DD, or None if it isn't resolved.
+    :return tuple: Days of the sprint, remaining points per day, guideline per day, and total points.
+    """
 
-    Return the filename of the newly created burndown chart so that Discord can open it.
+    first_day = np.datetime64(start, 'D')
+    days = np.arange(first_day, np.datetime64(end, 'D'))
+    points = np.asarray(points, dtype=np.int64)
+    total = int(points.sum())
 
-    :param jira: The instance of the Jira class being used by the /sprint command
-    :param issues: Collection of sprint issues retrieved by the Jira class instance
-    :return str: Filename of the newly created burndown chart
+    resolved = np.array(resolved, dtype='datetime64[D]')  # unresolved issues become NaT
+    counted = ~np.isnat(resolved)
+    offsets = (resolved[counted] - first_day).astype(np.int64)
+    in_sprint = offsets < len(days)
+    done_per_day = np.bincount(np.clip(offsets[in_sprint], 0, None), weights=points[counted][in_sprint],
+                               minlength=len(days))
+    remaining = total - np.cumsum(done_per_day).astype(np.int64)
+    guideline = np.linspace(total, 0, len(days))
+
+    return days, remaining, guideline, total
+
+
+def active_sprint(issues):
+    """
+    Get the active sprint that a collection of issues belongs to, as listed in the issues' sprint field.
+
+    :param issues: Collection of sprint issues retrieved by the Jira class instance.
+    :return dict: The sprint's id, name, state, start and end dates.
+    """
+
+    sprints = issues[-1].raw['fields'][SPRINT_FIELD]
+    for sprint in sprints:
+        if sprint.get('state') == 'active':
+            return sprint
+    return sprints[0]
+
+
+def sprint_id(issues):
+    """
+    Get the ID of the active sprint that a collection of issues belongs to.
+
+    :param issues: Collection of sprint issues retrieved by the Jira class instance.
+    :return int: The sprint's ID.
+    """
+
+    return active_sprint(issues)['id']
+
+
+def issue_points(issue):
+    """
+    Get the story points of an issue, or 0 if it doesn't have any.
+
+    :param issue: An issue retrieved by the Jira class instance.
+    :return int: The issue's story points.
+    """
+
+    return int(issue.raw['fields'].get(STORY_POINTS_FIELD) or 0)
+
+
+def issue_resolution_date(issue):
     """
+    Get the day an issue was resolved on, or None if it's unresolved.
 
-    total_points = 0
-    for i in issues:
-        if i.raw['fields'].get('customfield_10026') is not None:
-            total_points += int(i.raw['fields']['customfield_10026'])
-        else:
-            total_points += 0
-        sprint_id = i.raw['fields']['customfield_10020'][0]['id']
+    :param issue: An issue retrieved by the Jira class instance.
+    :return str: The resolution date as YYYY-MM-DD.
+    """
+
+    resolution_date = issue.raw['fields'].get('resolutiondate')
+    return resolution_date[:10] if resolution_date else None
+
+
+def sprint_fingerprint(issues):
+    """
+    Hash the parts of a sprint and its issues that a burndown chart depends on.
+
+    The chart is titled with the sprint's name and spans its start and end
+    dates, so those are taken from the issues' sprint field along with each
+    issue's key, story points and resolution date. Editing the sprint or any
+    of its issues changes the fingerprint.
+
+    :param issues: Collection of sprint issues retrieved by the Jira class instance.
+    :return str: Hex digest of the sprint's (name, start, end) and the issues' (key, points, resolution date).
+    """
+
+    sprint = active_sprint(issues)
+    state = (sprint.get('name'), sprint.get('startDate'), sprint.get('endDate'),
+             sorted((i.key, issue_points(i), issue_resolution_date(i) or '') for i in issues))
+    return hashlib.sha256(repr(state).encode()).hexdigest()
+
+
+def render_burndown(title, days, remaining, guideline, total_points):
+    """
+    Draw a burndown chart and return it as PNG bytes.
+
+    The chart is drawn on its own Figure with the Agg canvas instead of pyplot's
+    global state, so nothing is left registered after the figure goes out of
+    scope. This runs in the render process pool.
+
+    :param str title: Name of the sprint.
+    :param days: Days of the sprint.
+    :param remaining: Remaining story points per day.
+    :param guideline: Guideline points per day.
+    :param int total_points: Total story points in the sprint.
+    :return bytes: The chart as a PNG image.
+    """
+
+    fig = Figure(figsize=(12, 4))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.step(days, remaining, 'r-', label='Remaining Story Points', where='post')
+    ax.plot(days, guideline, color='grey', label='Guideline')
+    if len(days) > 1:
+        ax.set_xlim([days[0], days[-1]])
+    ax.set_ylim([0, total_points + 1])
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Story Points')
+    ax.legend()
+    ax.set_title('Burndown Chart for Sprint \"{0}\" '.format(title))
+    fig.autofmt_xdate()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+def _get_render_pool():
+    global _render_pool
+    if _render_pool is None:
+        # spawn rather than fork so the workers don't inherit the bot's threads and event loop
+        _render_pool = ProcessPoolExecutor(max_workers=BURNDOWN_RENDER_WORKERS,
+                                           mp_context=multiprocessing.get_context('spawn'))
+    return _render_pool
+
+
+async def burndown(sprint, issues):
+    """
+    Utility method used by the /sprint command for creating a burndown chart.
+
+    Compute the remaining points and the guideline for each day of the sprint's
+    timespan with burndown_series(), then draw the chart in the render process
+    pool so the event loop isn't blocked by matplotlib.
+
+    :param sprint: The sprint retrieved by the Jira class instance
+    :param issues: Collection of sprint issues retrieved by the Jira class instance
+    :return bytes: The burndown chart as a PNG image
+    """
 
-    # Get start and end date of sprint
-    sprint = jira.sprint(sprint_id)
     start = sprint.raw['startDate'].split('T')[0]
     end = sprint.raw['endDate'].split('T')[0]
+    days, remaining, guideline, total_points = burndown_series(start, end,
+                                                               [issue_points(i) for i in issues],
+                                                               [issue_resolution_date(i) for i in issues])
 
-    # Timespan of sprint
-    date_range = pd.date_range(start=start, end=end, freq='D', inclusive='left')
-
-    remaining_points = {}
-    for d in date_range:
-        remaining = total_points
-        for i in issues:
-            # TODO: Replace exception with if-else checking for a None story points custom field
-            try:
-                # Remove issue's story points from remaining if its resolution date
-                # is before/on current date in sprint timespan
-                if i.fields.resolutiondate.split('T')[0] <= d.strftime('%Y-%m-%d'):
-                    if i.raw['fields'].get('customfield_10026') is not None:
-                        remaining -= int(i.raw['fields']['customfield_10026'])
-                    else:
-                        remaining -= 0
-            except AttributeError:
-                pass
-        remaining_points[d.strftime('%Y-%m-%d')] = int(remaining) # Put remaining points value in date/points dict
-
-    slope = -total_points / (len(remaining_points.keys()) - 1)  # get slope of ideal pace for guideline (linear decline)
-
-    # Create guideline
-    guideline = {}
-    for i, k in zip(range(0, len(remaining_points.keys())), remaining_points.keys()):
-        guideline[k] = (slope * i) + total_points  # should be a straight line
-
-    # Plot chart
-    fig = plt.figure(figsize=(12, 4))
-    plt.step(remaining_points.keys(), remaining_points.values(), 'r-', label='Remaining Story Points', where='post')
-    plt.plot(guideline.keys(), guideline.values(), color='grey', label='Guideline')
-    plt.xlim([min(remaining_points.keys()), max(remaining_points.keys())])
-    plt.ylim([0, total_points + 1])
-    plt.xlabel('Date')
-    plt.ylabel('Story Points')
-    plt.legend()
-    plt.title('Burndown Chart for Sprint \"{0}\" '.format(sprint.raw['name']))
-    plt.gcf().autofmt_xdate()
-    # Create filename using current date
-    filename = 'burndown-' + datetime.now().strftime('%Y-%m-%d') + '-' + str(sprint.raw['id']) + '.jpg'
-    # Save the plot locally
-    plt.savefig(filename)
-    # Return the filename
-    return filename
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_render_pool(), render_burndown, sprint.raw['name'], days, remaining,
+                                      guideline, total_points)
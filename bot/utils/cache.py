@@ -0,0 +1,248 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Size-bounded cache that evicts the least recently used entry when full.
+
+    Safe to share between the event loop and executor threads.
+
+    Methods
+    --------
+    get(key, default):
+        Get a cached value and mark it as recently used.
+
+    put(key, value):
+        Cache a value, evicting the oldest entry if the cache is full.
+
+    pop(key, default):
+        Remove a value from the cache.
+
+    stats(): dict
+        Get the cache's size and hit/miss counts.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """
+        Get a cached value and mark it as the most recently used.
+
+        :param key: The entry's key.
+        :param default: Returned if the key isn't cached.
+        :return: The cached value or default.
+        """
+
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting the least recently used entry if the cache is full.
+
+        :param key: The entry's key.
+        :param value: The value to cache.
+        :return: None
+        """
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Remove a value from the cache.
+
+        :param key: The entry's key.
+        :param default: Returned if the key isn't cached.
+        :return: The removed value or default.
+        """
+
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def stats(self) -> dict:
+        """
+        Get the cache's size and hit/miss counts.
+
+        :return dict: Entries, capacity, hits and misses.
+        """
+
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+class TTLCache:
+    """
+    Size-bounded cache whose entries expire a fixed time after they are added.
+
+    Entries are kept in the order they were added, which is also the order they
+    expire in, so expired entries are always at the front and are removed as new
+    ones come in. If the cache is full, the oldest entry is evicted early.
+
+    If a StateStore is given, entries are loaded from the namespace on creation
+    (skipping the ones that have expired) and every change is written back, so
+    the cache survives restarts. Keys and values must be JSON-serializable then.
+
+    Safe to share between the event loop and executor threads.
+
+    Methods
+    --------
+    get(key, default):
+        Get a value if it hasn't expired.
+
+    put(key, value):
+        Cache a value, restarting its time to live.
+
+    add(key, value): bool
+        Cache a value only if the key isn't cached yet.
+
+    pop(key, default):
+        Remove a value from the cache.
+
+    stats(): dict
+        Get the cache's size and hit/miss counts.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, store=None, namespace: str = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires at, value)
+        self._lock = threading.Lock()
+        self._store = store
+        self._namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        if store is not None:
+            now = time.time()
+            entries = sorted(store.load(namespace).items(), key=lambda item: item[1][0])
+            for key, (expires_at, value) in entries:
+                if expires_at > now:
+                    self._entries[key] = (expires_at, value)
+                else:
+                    store.delete(namespace, key)
+            self._evict(now)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > time.time()
+
+    def _evict(self, now):
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.maxsize:
+                break
+            self._remove(key)
+
+    def _remove(self, key):
+        self._entries.pop(key)
+        if self._store is not None:
+            self._store.delete(self._namespace, key)
+
+    def _insert(self, key, value, now):
+        expires_at = now + self.ttl
+        self._entries.pop(key, None)
+        self._entries[key] = (expires_at, value)
+        if self._store is not None:
+            self._store.put(self._namespace, key, [expires_at, value])
+        self._evict(now)
+
+    def get(self, key, default=None):
+        """
+        Get a cached value if it hasn't expired.
+
+        :param key: The entry's key.
+        :param default: Returned if the key isn't cached or has expired.
+        :return: The cached value or default.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """
+        Cache a value. Its time to live starts over if the key was already cached.
+
+        :param key: The entry's key.
+        :param value: The value to cache.
+        :return: None
+        """
+
+        with self._lock:
+            self._insert(key, value, time.time())
+
+    def add(self, key, value=True) -> bool:
+        """
+        Cache a value only if the key isn't cached yet, as a single step.
+
+        Counts a hit if the key was already cached and a miss if it was added.
+
+        :param key: The entry's key.
+        :param value: The value to cache.
+        :return bool: False if the key was already cached and nothing changed.
+        """
+
+        with self._lock:
+            now = time.time()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return False
+            self.misses += 1
+            self._insert(key, value, now)
+            return True
+
+    def pop(self, key, default=None):
+        """
+        Remove a value from the cache.
+
+        :param key: The entry's key.
+        :param default: Returned if the key isn't cached.
+        :return: The removed value or default.
+        """
+
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries[key][1]
+            self._remove(key)
+            return value
+
+    def stats(self) -> dict:
+        """
+        Get the cache's size and hit/miss counts.
+
+        :return dict: Entries, capacity, time to live, hits and misses.
+        """
+
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'ttl': self.ttl, 'hits': self.hits,
+                'misses': self.misses}
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+_context = threading.local()
+
+
+def current_priority() -> str:
+    """
+    Get the priority of the call running on the current executor thread.
+
+    Lets code deep inside a library call (e.g. PyGithub's connection class) tell
+    a command the user is waiting on from background work.
+
+    :return str: INTERACTIVE or BACKGROUND.
+    """
+
+    return getattr(_context, 'priority', INTERACTIVE)
+
+
+class BlockingExecutor:
+    """
+    Run blocking library calls (PyGithub, jira) on a bounded thread pool.
+
+    Command handlers and webhook routers share one event loop, so any call that
+    waits on the network has to be moved off of it. Calls are submitted with
+    run() and awaited like any other coroutine. The executor keeps track of how
+    many calls are running, how many are waiting for a free worker, and how long
+    they waited in the queue.
+
+    If background_workers is given, background work runs on a separate pool of
+    that size, so prefetches and polling that wait on a rate limit can't take
+    the workers commands run on.
+
+    Methods
+    --------
+    run(func, *args, **kwargs):
+        Run func on the pool and return its result.
+
+    run_background(func, *args, **kwargs):
+        Run func on the pool as background work and return its result.
+
+    stats(): dict
+        Get a snapshot of the executor's counters.
+    """
+
+    def __init__(self, name: str, max_workers: int, background_workers: int = None):
+        self.name = name
+        self.max_workers = max_workers
+        self.background_workers = background_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._background_pool = ThreadPoolExecutor(max_workers=background_workers,
+                                                   thread_name_prefix=f'{name}-background') \
+            if background_workers else self._pool
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _call(self, submitted, priority, func, args, kwargs):
+        _context.priority = priority
+        wait = time.monotonic() - submitted
+        with self._lock:
+            self.queued -= 1
+            self.in_flight += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            _context.priority = INTERACTIVE
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+        return result
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run a blocking function on the pool without blocking the event loop.
+
+        Exceptions raised by the function are re-raised in the awaiting coroutine.
+
+        :param func: The blocking callable.
+        :return: Whatever func returns.
+        """
+
+        return await self._submit(INTERACTIVE, func, args, kwargs)
+
+    async def run_background(self, func, *args, **kwargs):
+        """
+        Run a blocking function on the pool as background work (prefetching, polling).
+
+        Works like run(), but current_priority() returns BACKGROUND while the
+        function runs, so rate limited clients can hold it back in favour of
+        commands. It runs on the background pool, if the executor has one.
+
+        :param func: The blocking callable.
+        :return: Whatever func returns.
+        """
+
+        return await self._submit(BACKGROUND, func, args, kwargs)
+
+    async def _submit(self, priority, func, args, kwargs):
+        loop = asyncio.get_running_loop()
+        pool = self._background_pool if priority == BACKGROUND else self._pool
+        with self._lock:
+            self.queued += 1
+        return await loop.run_in_executor(pool, self._call, time.monotonic(), priority, func, args, kwargs)
+
+    def stats(self) -> dict:
+        """
+        Get a snapshot of the executor's counters.
+
+        :return dict: Calls queued and in flight, completed/failed totals and queue wait times in ms.
+        """
+
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'background_workers': self.background_workers,
+                'queued': self.queued,
+                'in_flight': self.in_flight,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait_ms': round(self.total_wait / self.completed * 1000, 2) if self.completed else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 2),
+            }
@@ -0,0 +1,473 @@
+import hashlib
+import os
+import threading
+import time
+import requests
+from requests.structures import CaseInsensitiveDict
+from github.GithubException import RateLimitExceededException
+from github.Issue import Issue
+from github.MainClass import Github
+from github.PullRequest import PullRequest
+from github.Repository import Repository
+from github.Requester import Requester, HTTPRequestsConnectionClass
+from bot.utils.cache import LRUCache, TTLCache
+from bot.utils.executor import BlockingExecutor, BACKGROUND, current_priority
+
+GITHUB_WORKERS = int(os.getenv('GITHUB_WORKERS', 8))
+GITHUB_BACKGROUND_WORKERS = int(os.getenv('GITHUB_BACKGROUND_WORKERS', 2))
+# items per page of list results, GitHub's own default
+GITHUB_PER_PAGE = int(os.getenv('GITHUB_PER_PAGE', 30))
+GITHUB_RESPONSE_CACHE_SIZE = int(os.getenv('GITHUB_RESPONSE_CACHE_SIZE', 2048))
+# total length of the response bodies the cache holds, and the longest body it caches at all
+GITHUB_RESPONSE_CACHE_BYTES = int(os.getenv('GITHUB_RESPONSE_CACHE_BYTES', 64 * 1024 * 1024))
+GITHUB_RESPONSE_MAX_BODY = int(os.getenv('GITHUB_RESPONSE_MAX_BODY', 1024 * 1024))
+# share of each token's hourly budget that background work leaves to commands
+GITHUB_BACKGROUND_RESERVE = float(os.getenv('GITHUB_BACKGROUND_RESERVE', 0.2))
+# longest a request waits for its token's budget to reset before failing with RateLimitExceededException
+GITHUB_MAX_RATE_WAIT = float(os.getenv('GITHUB_MAX_RATE_WAIT', 30))
+GITHUB_CLIENT_IDLE_TIMEOUT = int(os.getenv('GITHUB_CLIENT_IDLE_TIMEOUT', 900))
+GITHUB_REPO_CACHE_SIZE = int(os.getenv('GITHUB_REPO_CACHE_SIZE', 512))
+GITHUB_REPO_TTL = float(os.getenv('GITHUB_REPO_TTL', 300))
+
+# PyGithub only has a blocking API, so every call made from a command handler goes through this pool.
+# Background work has its own workers, since it may wait for a rate limit reset.
+github_executor = BlockingExecutor('github', GITHUB_WORKERS, GITHUB_BACKGROUND_WORKERS)
+
+# One keep-alive connection pool for every GitHub request, sized for the executor's workers
+_session = requests.Session()
+_session.mount('https://', requests.adapters.HTTPAdapter(max_retries=requests.adapters.DEFAULT_RETRIES,
+                                                         pool_maxsize=GITHUB_WORKERS + GITHUB_BACKGROUND_WORKERS))
+
+
+def token_scope(authorization) -> str:
+    """
+    Get a key identifying whose token a request was made with, without keeping the token.
+
+    :param str authorization: The request's Authorization header, or None.
+    :return str: A hash of the header, or an empty string for anonymous requests.
+    """
+
+    if not authorization:
+        return ''
+    return hashlib.sha256(authorization.encode()).hexdigest()[:16]
+
+
+class ResponseCache(LRUCache):
+    """
+    LRU cache of GitHub GET responses keyed by (token scope, URL).
+
+    Besides the number of entries, the cache is bounded by the total length of
+    the response bodies it holds: least recently used responses are evicted
+    until the total is at most maxbytes. Responses with a body longer than
+    maxbody aren't cached at all, so one large list page can't push out
+    everything else.
+
+    Counts how many conditional requests were answered with 304 Not Modified,
+    which GitHub doesn't count against the token's rate limit.
+    """
+
+    def __init__(self, maxsize: int, maxbytes: int = GITHUB_RESPONSE_CACHE_BYTES,
+                 maxbody: int = GITHUB_RESPONSE_MAX_BODY):
+        super().__init__(maxsize)
+        self.maxbytes = maxbytes
+        self.maxbody = maxbody
+        self.bytes = 0
+        self.too_large = 0
+        self.not_modified = 0
+        self.modified = 0
+
+    def put(self, key, value):
+        """
+        Cache a response, evicting the least recently used ones until both bounds are met.
+
+        :param key: The (token scope, URL) of the request.
+        :param GithubResponse value: The response.
+        :return: None
+        """
+
+        size = len(value.text)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old.text)
+            if size > self.maxbody:
+                self.too_large += 1
+                return
+            self._entries[key] = value
+            self.bytes += size
+            while len(self._entries) > self.maxsize or self.bytes > self.maxbytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted.text)
+
+    def pop(self, key, default=None):
+        """
+        Remove a response from the cache.
+
+        :param key: The (token scope, URL) of the request.
+        :param default: Returned if the key isn't cached.
+        :return: The removed response or default.
+        """
+
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is None:
+                return default
+            self.bytes -= len(value.text)
+            return value
+
+    def stats(self) -> dict:
+        """
+        Get the cache's size, hit/miss counts and revalidation results.
+
+        :return dict: Entries, capacity, body bytes, hits, misses, and 304/200 revalidation counts.
+        """
+
+        return dict(super().stats(), bytes=self.bytes, maxbytes=self.maxbytes, too_large=self.too_large,
+                    not_modified=self.not_modified, modified=self.modified)
+
+
+github_responses = ResponseCache(GITHUB_RESPONSE_CACHE_SIZE)
+
+
+class RateLimitTracker:
+    """
+    Track the rate limit budget of each GitHub token from response headers.
+
+    Every response's X-RateLimit-Limit, -Remaining and -Reset headers update
+    the budget of the token (scope) it was made with, and every request takes
+    one off the budget before it is sent, so concurrent requests see each other.
+    Before a request is sent, acquire() decides whether it has to wait:
+
+    - Background work (current_priority() is BACKGROUND) stops once only
+      GITHUB_BACKGROUND_RESERVE of the budget is left, and waits for the budget
+      to reset, so commands keep working when a token is busy. It waits on the
+      executor's background workers, so commands never queue behind it.
+    - Commands use the whole budget. When it runs out, they wait for the reset
+      instead of failing, if it is at most GITHUB_MAX_RATE_WAIT seconds away.
+
+    Waits longer than GITHUB_MAX_RATE_WAIT are not made. The request raises
+    RateLimitExceededException instead, with the reset time in its
+    x-ratelimit-reset header, like the one GitHub's own 403 reply raises.
+
+    Methods
+    --------
+    update(scope, headers):
+        Update a token's budget from a response.
+
+    acquire(scope, priority):
+        Wait until a request may be sent and take it off the budget.
+
+    stats(): dict
+        Get the budget and throttling counters of each token.
+    """
+
+    def __init__(self, reserve: float = GITHUB_BACKGROUND_RESERVE, max_wait: float = GITHUB_MAX_RATE_WAIT):
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self._budgets = {}  # token scope -> budget dict
+        self._lock = threading.Lock()
+
+    def update(self, scope: str, headers):
+        """
+        Update a token's budget from a response's rate limit headers.
+
+        :param str scope: The token scope the request was made with.
+        :param headers: The response headers.
+        :return: None
+        """
+
+        if 'X-RateLimit-Remaining' not in headers:
+            return
+        with self._lock:
+            budget = self._budget(scope)
+            budget['limit'] = int(headers.get('X-RateLimit-Limit', budget['limit']))
+            budget['remaining'] = int(headers['X-RateLimit-Remaining'])
+            budget['reset'] = int(headers.get('X-RateLimit-Reset', budget['reset']))
+
+    def _budget(self, scope):
+        budget = self._budgets.get(scope)
+        if budget is None:
+            budget = self._budgets[scope] = {'limit': 0, 'remaining': 0, 'reset': 0, 'requests': 0,
+                                             'background_requests': 0, 'throttled': 0, 'rejected': 0,
+                                             'waited_s': 0.0}
+        return budget
+
+    def _delay(self, budget, priority, now):
+        if budget['reset'] <= now:
+            return 0  # no budget seen yet, or the window has reset
+        floor = budget['limit'] * self.reserve if priority == BACKGROUND else 0
+        if budget['remaining'] > floor:
+            return 0
+        return budget['reset'] - now
+
+    def acquire(self, scope: str, priority: str):
+        """
+        Wait until a request may be sent and take it off the token's budget.
+
+        :param str scope: The token scope the request is made with.
+        :param str priority: INTERACTIVE or BACKGROUND.
+        :raises RateLimitExceededException: If the request would have to wait longer than max_wait.
+        :return: None
+        """
+
+        with self._lock:
+            budget = self._budget(scope)
+            delay = self._delay(budget, priority, time.time())
+            if delay > self.max_wait:
+                budget['rejected'] += 1
+                if priority == BACKGROUND and budget['remaining']:
+                    message = 'Rate limit budget reserved for commands.'
+                else:
+                    message = 'API rate limit exceeded.'
+                raise RateLimitExceededException(403, {'message': message},
+                                                 {'x-ratelimit-reset': str(budget['reset'])})
+            if delay:
+                budget['throttled'] += 1
+                budget['waited_s'] += delay
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            budget['requests'] += 1
+            if priority == BACKGROUND:
+                budget['background_requests'] += 1
+            budget['remaining'] = max(budget['remaining'] - 1, 0)
+
+    def stats(self) -> dict:
+        """
+        Get the budget and throttling counters of each token.
+
+        :return dict: Token scope mapped to its limit, remaining requests, reset time and counters.
+        """
+
+        with self._lock:
+            return {scope: dict(budget, waited_s=round(budget['waited_s'], 2))
+                    for scope, budget in self._budgets.items()}
+
+
+github_rate_limits = RateLimitTracker()
+
+
+class GithubResponse:
+    # mimic the httplib response object, like PyGithub's RequestsResponse
+    def __init__(self, status, headers, text):
+        self.status = status
+        self.headers = headers
+        self.text = text
+
+    def getheaders(self):
+        return self.headers.items()
+
+    def read(self):
+        return self.text
+
+
+class ConditionalConnection:
+    """
+    Connection class for PyGithub that makes GET requests conditional.
+
+    Mimics PyGithub's HTTPSRequestsConnectionClass, but sends every request
+    through the shared keep-alive session. The body, ETag and Last-Modified of
+    successful GET responses are kept in github_responses, keyed by the token's
+    scope and the URL, and later GETs of the same URL send If-None-Match and
+    If-Modified-Since. A 304 reply is turned back into the cached 200 response
+    (with the 304's up-to-date rate limit headers), so PyGithub never sees it.
+
+    Requests wait for their token's rate limit budget in github_rate_limits
+    before they are sent, and every response updates it.
+    """
+
+    def __init__(self, host, port=None, strict=False, timeout=None, retry=None, pool_size=None, **kwargs):
+        self.host = host
+        self.port = port if port else 443
+        self.timeout = timeout
+        self.verify = kwargs.get('verify', True)
+
+    def request(self, verb, url, input, headers):
+        self.verb = verb
+        self.url = url
+        self.input = input
+        self.headers = headers
+
+    def getresponse(self):
+        key = cached = None
+        headers = self.headers
+        scope = token_scope(headers.get('Authorization'))
+        if self.verb == 'GET':
+            key = (scope, self.url)
+            cached = github_responses.get(key)
+            if cached is not None:
+                headers = dict(headers)
+                if 'ETag' in cached.headers:
+                    headers['If-None-Match'] = cached.headers['ETag']
+                if 'Last-Modified' in cached.headers:
+                    headers['If-Modified-Since'] = cached.headers['Last-Modified']
+
+        github_rate_limits.acquire(scope, current_priority())
+        r = _session.request(self.verb, f'https://{self.host}:{self.port}{self.url}', headers=headers,
+                             data=self.input, timeout=self.timeout, verify=self.verify, allow_redirects=False)
+        github_rate_limits.update(scope, r.headers)
+
+        if cached is not None:
+            if r.status_code == 304:
+                github_responses.not_modified += 1
+                headers = CaseInsensitiveDict(cached.headers)
+                headers.update(r.headers)
+                return GithubResponse(200, headers, cached.text)
+            github_responses.modified += 1
+        response = GithubResponse(r.status_code, CaseInsensitiveDict(r.headers), r.text)
+        if key is not None and r.status_code == 200 and ('ETag' in r.headers or 'Last-Modified' in r.headers):
+            github_responses.put(key, response)
+        return response
+
+    def close(self):
+        return
+
+
+Requester.injectConnectionClasses(HTTPRequestsConnectionClass, ConditionalConnection)
+
+
+class GithubClientPool:
+    """
+    Pool of reusable Github clients keyed by token.
+
+    Clients are created once per token and reused by every command after that.
+    All of them send their requests through the shared keep-alive session of
+    ConditionalConnection. Clients that haven't been used for idle_timeout
+    seconds are evicted, and invalidate() drops a token's client when the token
+    is removed.
+
+    Methods
+    --------
+    get(token): Github
+        Get the pooled client for a token, creating it if needed.
+
+    invalidate(token):
+        Drop the client created with a token.
+
+    evict_idle():
+        Drop clients that have been idle for too long.
+    """
+
+    def __init__(self, idle_timeout: int = GITHUB_CLIENT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._clients = {}  # token -> [client, time of last use]
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Github:
+        """
+        Get the pooled client for a GitHub token.
+
+        :param str token: OAuth access token of the user.
+        :return Github: The client.
+        """
+
+        now = time.monotonic()
+        if now - self._last_sweep > self.idle_timeout:
+            self.evict_idle()
+
+        with self._lock:
+            entry = self._clients.get(token)
+            if entry is not None:
+                entry[1] = now
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            entry = self._clients[token] = [Github(token, per_page=GITHUB_PER_PAGE), now]
+            return entry[0]
+
+    def invalidate(self, token: str):
+        """
+        Drop the client that was created with a token.
+
+        :param str token: The token being replaced or removed.
+        :return: None
+        """
+
+        with self._lock:
+            self._clients.pop(token, None)
+
+    def evict_idle(self):
+        """
+        Drop clients that haven't been used for idle_timeout seconds.
+
+        :return: None
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            self._last_sweep = now
+            for token in [t for t, (_, last_used) in self._clients.items() if now - last_used > self.idle_timeout]:
+                del self._clients[token]
+
+    def stats(self) -> dict:
+        """
+        Get a snapshot of the pool's counters.
+
+        :return dict: Pooled clients and hit/miss totals.
+        """
+
+        with self._lock:
+            return {'clients': len(self._clients), 'hits': self.hits, 'misses': self.misses}
+
+
+github_clients = GithubClientPool()
+
+# Repository objects keyed by (token scope, full name), so commands don't have to fetch them every time
+github_repos = TTLCache(GITHUB_REPO_CACHE_SIZE, GITHUB_REPO_TTL)
+
+
+def get_repo(token: str, full_name: str, lazy: bool = False) -> Repository:
+    """
+    Get a repository with a token's pooled client. This is a blocking call.
+
+    Repositories are cached for GITHUB_REPO_TTL seconds per token. A lazy
+    repository is only a handle for building URLs: if the repository isn't
+    cached, it is returned without being fetched, and anything beyond its URL
+    is fetched when first read.
+
+    :param str token: OAuth access token of the user.
+    :param str full_name: Full name of the repository (owner/name).
+    :param bool lazy: Skip fetching the repository if it isn't cached.
+    :return Repository: The repository.
+    """
+
+    key = (token_scope(token), full_name.lower())
+    repo = github_repos.get(key)
+    if repo is not None:
+        return repo
+    repo = github_clients.get(token).get_repo(full_name, lazy=lazy)
+    if not lazy:
+        github_repos.put(key, repo)
+    return repo
+
+
+def get_issue(token: str, full_name: str, number: int) -> Issue:
+    """
+    Get an issue with a token's pooled client. This is a blocking call.
+
+    The repository is only used to build the issue's URL, so only the issue
+    is fetched, and repeated fetches are answered by the ETag cache.
+
+    :param str token: OAuth access token of the user.
+    :param str full_name: Full name of the repository.
+    :param int number: Number of the issue.
+    :return Issue: The issue.
+    """
+
+    return get_repo(token, full_name, lazy=True).get_issue(number)
+
+
+def get_pull(token: str, full_name: str, number: int) -> PullRequest:
+    """
+    Get a pull request with a token's pooled client. This is a blocking call.
+
+    :param str token: OAuth access token of the user.
+    :param str full_name: Full name of the repository.
+    :param int number: Number of the pull request.
+    :return PullRequest: The pull request.
+    """
+
+    return get_repo(token, full_name, lazy=True).get_pull(number)
@@ -0,0 +1,147 @@
+import threading
+from github.GithubException import GithubException
+from github.Repository import Repository
+from bot.utils.github_client import get_repo
+
+# everything the /webhook/github route handles, in a single hook per repository
+HOOK_EVENTS = ['push', 'issues', 'pull_request', 'create', 'delete']
+# routes of the per-event hooks add_repo used to create
+LEGACY_HOOK_PATHS = ('/webhook/commits', '/webhook/issues', '/webhook/pull-request')
+
+
+class HookManager:
+    """
+    Manager of the webhook CollabyBot installs on each tracked repository.
+
+    Every repository gets one hook covering all HOOK_EVENTS, no matter how
+    many guilds track it. The hook is created when the first guild adds the
+    repository and shared by every guild that adds it after that. The guilds
+    tracking the repository in the subscription index act as the hook's
+    reference count: once the last one removes the repository, the hook is
+    deleted through the API.
+
+    Hook ids are loaded from the StateStore namespace on creation and every
+    change is written back to it. Installing and deleting hooks are blocking
+    calls and should be run with the GitHub executor. The lock and reference
+    count only cover the current process, which is fine since the single
+    gateway process is the only one that runs the bot's commands.
+
+    Methods
+    --------
+    acquire(repo): bool
+        Make sure a repository has the hook, creating it if needed.
+
+    release(token, full_name): bool
+        Delete a repository's hook if no guild tracks the repository anymore.
+
+    hook_id(full_name): int
+        Get the id of a repository's hook.
+
+    stats(): dict
+        Get the number of hooks.
+    """
+
+    def __init__(self, url: str, subscriptions, store=None, namespace: str = None):
+        self.url = url
+        self._subscriptions = subscriptions
+        self._store = store
+        self._namespace = namespace
+        self._hooks = dict(store.load(namespace)) if store is not None else {}  # repo -> hook id
+        self._lock = threading.Lock()  # keeps two guilds adding a repo at once from creating two hooks
+
+    def hook_id(self, full_name: str):
+        """
+        Get the id of a repository's hook.
+
+        :param str full_name: Full name of the repository.
+        :return int: The id of the hook, or None if it isn't installed.
+        """
+
+        return self._hooks.get(full_name)
+
+    def acquire(self, repo: Repository) -> bool:
+        """
+        Make sure a repository has the hook, creating it if needed. This is a blocking call.
+
+        If the repository has no known hook, its hooks are listed: a hook that
+        already points at the webhook URL is adopted (and given any missing
+        events), hooks pointing at the legacy per-event routes are deleted, and
+        a new hook is only created if none was adopted.
+
+        :param Repository repo: The repository, fetched with the token of the user adding it.
+        :return bool: True if the hook was installed now, False if the repository already had it.
+        """
+
+        with self._lock:
+            if repo.full_name in self._hooks:
+                return False
+
+            hook = None
+            legacy_urls = {self._base_url() + path for path in LEGACY_HOOK_PATHS}
+            for existing in repo.get_hooks():
+                url = existing.config.get('url')
+                if url == self.url and hook is None:
+                    hook = existing
+                elif url in legacy_urls:
+                    existing.delete()
+
+            config = {'url': self.url, 'content_type': 'json'}
+            if hook is None:
+                hook = repo.create_hook(name='web', config=config, events=HOOK_EVENTS, active=True)
+            elif not set(HOOK_EVENTS) <= set(hook.events):
+                hook.edit(name='web', config=config, events=HOOK_EVENTS, active=True)
+
+            self._set(repo.full_name, hook.id)
+            return True
+
+    def release(self, token: str, full_name: str) -> bool:
+        """
+        Delete a repository's hook if no guild tracks the repository anymore. This is a blocking call.
+
+        GitHub answers 404 both for a hook that doesn't exist and for a token
+        without admin access to the repository, so the token has to be an
+        admin's. With one, a hook that was already deleted on GitHub is just
+        forgotten. Without one, nothing is deleted and the hook id is kept.
+
+        :param str token: OAuth access token used to delete the hook.
+        :param str full_name: Full name of the repository.
+        :return bool: True if the hook was deleted (or was already gone), False if it's still installed.
+        """
+
+        with self._lock:
+            hook_id = self._hooks.get(full_name)
+            if hook_id is None or self._subscriptions.repo_guilds(full_name):
+                return False
+
+            repo = get_repo(token, full_name)
+            if repo.permissions is None or not repo.permissions.admin:
+                return False
+            try:
+                repo.get_hook(hook_id).delete()
+            except GithubException as ex:
+                if ex.status != 404:
+                    raise
+            self._set(full_name, None)
+            return True
+
+    def stats(self) -> dict:
+        """
+        Get the number of hooks.
+
+        :return dict: Number of repositories with a hook installed.
+        """
+
+        return {'hooks': len(self._hooks)}
+
+    def _base_url(self) -> str:
+        return self.url.rsplit('/webhook/', 1)[0]
+
+    def _set(self, full_name: str, hook_id):
+        if hook_id is None:
+            self._hooks.pop(full_name, None)
+            if self._store is not None:
+                self._store.delete(self._namespace, full_name)
+        else:
+            self._hooks[full_name] = hook_id
+            if self._store is not None:
+                self._store.put(self._namespace, full_name, hook_id)
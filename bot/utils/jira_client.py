@@ -0,0 +1,457 @@
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+from datetime import datetime
+import aiohttp
+from jira import JIRA
+from bot.utils.cache import TTLCache
+from bot.utils.executor import BlockingExecutor
+
+JIRA_API_URL = os.getenv('JIRA_API_URL')
+JIRA_RESOURCES_ENDPOINT = os.getenv('JIRA_RESOURCES_ENDPOINT')
+JIRA_RESOURCES_TIMEOUT = float(os.getenv('JIRA_RESOURCES_TIMEOUT', 10))
+JIRA_CLIENT_IDLE_TIMEOUT = int(os.getenv('JIRA_CLIENT_IDLE_TIMEOUT', 900))
+JIRA_WORKERS = int(os.getenv('JIRA_WORKERS', 8))
+JIRA_SEARCH_PAGE_SIZE = 100  # Jira Cloud caps search pages at 100 issues
+JIRA_USER_PAGE_SIZE = 1000  # Jira Cloud caps assignable user pages at 1000 users
+JIRA_USERS_CACHE_SIZE = int(os.getenv('JIRA_USERS_CACHE_SIZE', 256))
+JIRA_USERS_TTL = int(os.getenv('JIRA_USERS_TTL', 600))
+
+# The jira package only has a blocking API, so commands run their Jira calls through this pool
+jira_executor = BlockingExecutor('jira', JIRA_WORKERS)
+
+
+class JiraClientPool:
+    """
+    Pool of reusable JIRA clients keyed by (site id, token).
+
+    Building a JIRA object opens a new requests session and probes the server's
+    info before the first real call, so clients are created once per site and
+    token and reused by every command after that. Each client keeps its session
+    (and its keep-alive connections) for as long as it stays in the pool.
+    Clients that haven't been used for idle_timeout seconds are closed and
+    evicted, and invalidate() drops every client built from a token when the
+    token is replaced.
+
+    Methods
+    --------
+    get(site_id, token): JIRA
+        Get the pooled client for a site and token, creating it if needed.
+
+    invalidate(token):
+        Close and drop all clients created with a token.
+
+    evict_idle():
+        Close and drop clients that have been idle for too long.
+    """
+
+    def __init__(self, idle_timeout: int = JIRA_CLIENT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._clients = {}  # (site id, token) -> [client, time of last use]
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, site_id: str, token: str) -> JIRA:
+        """
+        Get the pooled client for a Jira site and OAuth token.
+
+        :param str site_id: Cloud ID of the Jira site.
+        :param str token: OAuth access token of the user.
+        :return JIRA: A client with an open session.
+        """
+
+        now = time.monotonic()
+        if now - self._last_sweep > self.idle_timeout:
+            self.evict_idle()
+
+        key = (site_id, token)
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry[1] = now
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        options = {
+            'server': f'{JIRA_API_URL}/{site_id}',
+            'headers': {
+                'Authorization': f'Bearer {token}'
+            }
+        }
+        client = JIRA(options=options)
+
+        with self._lock:
+            # another thread may have built the same client in the meantime, keep the first one
+            entry = self._clients.setdefault(key, [client, now])
+        if entry[0] is not client:
+            client.close()
+        return entry[0]
+
+    def invalidate(self, token: str):
+        """
+        Close and drop every client that was created with a token.
+
+        :param str token: The token being replaced or removed.
+        :return: None
+        """
+
+        with self._lock:
+            stale = [key for key in self._clients if key[1] == token]
+            clients = [self._clients.pop(key)[0] for key in stale]
+        for client in clients:
+            client.close()
+
+    def evict_idle(self):
+        """
+        Close and drop clients that haven't been used for idle_timeout seconds.
+
+        :return: None
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            self._last_sweep = now
+            stale = [key for key, (_, last_used) in self._clients.items() if now - last_used > self.idle_timeout]
+            clients = [self._clients.pop(key)[0] for key in stale]
+        for client in clients:
+            client.close()
+
+    def stats(self) -> dict:
+        """
+        Get a snapshot of the pool's counters.
+
+        :return dict: Open clients and hit/miss totals.
+        """
+
+        with self._lock:
+            return {'clients': len(self._clients), 'hits': self.hits, 'misses': self.misses}
+
+
+jira_clients = JiraClientPool()
+
+
+async def search_all_issues(jira: JIRA, query: str, fields: list, page_size: int = JIRA_SEARCH_PAGE_SIZE) -> list:
+    """
+    Get every issue matching a JQL query, fetching only the given fields.
+
+    The first page is fetched on its own to learn the total number of results,
+    then all remaining pages are fetched concurrently on the Jira executor. The
+    page size actually used by the server is taken from the first page, since
+    Jira may return fewer issues than were asked for.
+
+    :param JIRA jira: The client to search with.
+    :param str query: The JQL query.
+    :param list fields: Names of the issue fields to include in the results.
+    :param int page_size: Number of issues to ask for per page.
+    :return list: The matching issues, in search order.
+    """
+
+    # search_issues rewrites the field list in place, so every call gets its own copy
+    first = await jira_executor.run(jira.search_issues, query, startAt=0, maxResults=page_size, fields=list(fields))
+    issues = list(first)
+    step = len(first)
+    if step == 0 or first.total <= step:
+        return issues
+
+    pages = await asyncio.gather(*(
+        jira_executor.run(jira.search_issues, query, startAt=start, maxResults=step, fields=list(fields),
+                          validate_query=False)
+        for start in range(step, first.total, step)
+    ))
+    for page in pages:
+        issues.extend(page)
+    return issues
+
+
+class JiraResourceResolver:
+    """
+    Async lookup of the Jira sites a token can access, cached until the token expires.
+
+    The accessible resources endpoint is called on a single aiohttp session, so
+    lookups reuse its pooled connections and never block the event loop. Each
+    token's sites are indexed by name and kept until the token's expiry, or
+    until invalidate() is called when the token is replaced. Concurrent
+    commands for the same token share a single lookup.
+
+    Methods
+    --------
+    sites(token, expires): dict
+        Get the sites a token can access.
+
+    site(token, expires, name): tuple
+        Find an accessible site by name.
+
+    invalidate(token):
+        Drop the cached sites of a token.
+
+    close():
+        Close the HTTP session.
+    """
+
+    def __init__(self, endpoint: str = JIRA_RESOURCES_ENDPOINT, timeout: float = JIRA_RESOURCES_TIMEOUT):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self._session = None
+        self._sites = {}  # token -> (expires at, {site name: site id})
+        self._fetches = {}  # token -> task fetching its sites
+        self.hits = 0
+        self.misses = 0
+
+    async def sites(self, token: str, expires: str) -> dict:
+        """
+        Get the sites a token can access, fetching them if they aren't cached.
+
+        :param str token: OAuth access token of the user.
+        :param str expires: Expiry time of the token, as stored in jira_tokens.
+        :return dict: IDs of the sites keyed by name.
+        :raises aiohttp.ClientResponseError: If Atlassian rejects the token (401) or fails to answer.
+        :raises asyncio.TimeoutError: If Atlassian doesn't answer in time.
+        """
+
+        entry = self._sites.get(token)
+        if entry is not None and entry[0] > time.time():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+
+        fetch = self._fetches.get(token)
+        if fetch is None:
+            fetch = asyncio.ensure_future(self._fetch(token, expires))
+            self._fetches[token] = fetch
+            fetch.add_done_callback(lambda _: self._fetches.pop(token, None))
+        # a command that gives up waiting mustn't cancel the lookup for the others
+        return await asyncio.shield(fetch)
+
+    async def _fetch(self, token: str, expires: str) -> dict:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        async with self._session.get(self.endpoint, headers={'Authorization': f'Bearer {token}',
+                                                             'Accept': 'application/json'}) as r:
+            r.raise_for_status()
+            sites = {site['name']: site['id'] for site in await r.json()}
+
+        # drop tokens that have expired since they were cached, then cache this one until it expires
+        now = time.time()
+        for stale in [key for key, (expires_at, _) in self._sites.items() if expires_at <= now]:
+            del self._sites[stale]
+        self._sites[token] = (datetime.strptime(expires, "%Y-%m-%d %H:%M:%S").timestamp(), sites)
+        return sites
+
+    async def site(self, token: str, expires: str, name: str):
+        """
+        Find a site a token can access by name.
+
+        :param str token: OAuth access token of the user.
+        :param str expires: Expiry time of the token, as stored in jira_tokens.
+        :param str name: Name of the site.
+        :return tuple: The name and ID of the site, or None if the token can't access it.
+        """
+
+        site_id = (await self.sites(token, expires)).get(name)
+        return (name, site_id) if site_id is not None else None
+
+    def invalidate(self, token: str):
+        """
+        Drop the cached sites of a token.
+
+        :param str token: The token being replaced or removed.
+        :return: None
+        """
+
+        self._sites.pop(token, None)
+
+    async def close(self):
+        """
+        Close the HTTP session.
+
+        :return: None
+        """
+
+        if self._session is not None:
+            await self._session.close()
+
+    def stats(self) -> dict:
+        """
+        Get the number of cached tokens and hit/miss totals.
+
+        :return dict: Cached tokens and hit/miss totals.
+        """
+
+        return {'tokens': len(self._sites), 'hits': self.hits, 'misses': self.misses}
+
+
+jira_resources = JiraResourceResolver()
+
+
+class AssignableUsers:
+    """
+    The users issues of a project can be assigned to, indexed by account id and display name.
+
+    Methods
+    --------
+    get(account_id): str
+        Get the display name of an account.
+
+    find(name): list
+        Get the users whose display name matches or starts with a name.
+    """
+
+    def __init__(self, users: list):
+        self.users = sorted(users, key=lambda user: user[1].lower())  # (account id, display name)
+        self._names = {account_id: name for account_id, name in self.users}
+        self._sorted_names = [name.lower() for _, name in self.users]
+
+    def __len__(self):
+        return len(self.users)
+
+    def get(self, account_id: str):
+        """
+        Get the display name of an account.
+
+        :param str account_id: Atlassian account ID of the user.
+        :return str: The display name, or None if the account can't be assigned issues of the project.
+        """
+
+        return self._names.get(account_id)
+
+    def find(self, name: str) -> list:
+        """
+        Get the users whose display name matches a name, ignoring case.
+
+        :param str name: The display name, or the start of it.
+        :return list: (account id, display name) of the exact matches, or of the users whose names start
+            with the given one if there are none.
+        """
+
+        prefix = name.lower()
+        start = bisect.bisect_left(self._sorted_names, prefix)
+        matches = []
+        for i in range(start, len(self.users)):
+            if not self._sorted_names[i].startswith(prefix):
+                break
+            matches.append(self.users[i])
+        exact = [user for user in matches if user[1].lower() == prefix]
+        return exact or matches
+
+
+class AssignableUserDirectory:
+    """
+    Cache of the assignable users of each Jira project, keyed by (site id, project key).
+
+    A project's users are fetched the first time they are needed, page by page
+    until Jira runs out of them, and kept for JIRA_USERS_TTL seconds. Concurrent
+    commands for the same project share a single fetch.
+
+    Methods
+    --------
+    get(jira, site_id, project): AssignableUsers
+        Get the assignable users of a project.
+
+    invalidate(site_id, project):
+        Drop the cached users of a project, so they are fetched again.
+
+    stats(): dict
+        Get the cache's size and hit/miss counts.
+    """
+
+    def __init__(self, maxsize: int = JIRA_USERS_CACHE_SIZE, ttl: int = JIRA_USERS_TTL):
+        self._cache = TTLCache(maxsize, ttl)
+        self._fetches = {}  # (site id, project) -> task fetching its users
+
+    async def get(self, jira: JIRA, site_id: str, project: str) -> AssignableUsers:
+        """
+        Get the assignable users of a project, fetching them if they aren't cached.
+
+        :param JIRA jira: The client to fetch the users with.
+        :param str site_id: Cloud ID of the Jira site.
+        :param str project: Key of the project.
+        :return AssignableUsers: The project's users.
+        """
+
+        key = (site_id, project.upper())
+        users = self._cache.get(key)
+        if users is not None:
+            return users
+
+        fetch = self._fetches.get(key)
+        if fetch is None:
+            fetch = asyncio.ensure_future(self._fetch(jira, key))
+            self._fetches[key] = fetch
+            fetch.add_done_callback(lambda _: self._fetches.pop(key, None))
+        # a command that gives up waiting mustn't cancel the fetch for the others
+        return await asyncio.shield(fetch)
+
+    async def _fetch(self, jira: JIRA, key: tuple) -> AssignableUsers:
+        users = AssignableUsers(await jira_executor.run(fetch_assignable_users, jira, key[1]))
+        self._cache.put(key, users)
+        return users
+
+    def invalidate(self, site_id: str, project: str):
+        """
+        Drop the cached users of a project.
+
+        :param str site_id: Cloud ID of the Jira site.
+        :param str project: Key of the project.
+        :return: None
+        """
+
+        self._cache.pop((site_id, project.upper()), None)
+
+    def stats(self) -> dict:
+        """
+        Get the cache's size and hit/miss counts.
+
+        :return dict: Cached projects and hit/miss totals.
+        """
+
+        return self._cache.stats()
+
+
+assignable_users = AssignableUserDirectory()
+
+
+def fetch_assignable_users(jira: JIRA, project: str, page_size: int = JIRA_USER_PAGE_SIZE) -> list:
+    """
+    Get every user issues of a project can be assigned to. This is a blocking call.
+
+    The endpoint returns a plain list without a total, and Jira may leave users
+    it filters out of a page without filling it up, so pages are fetched until
+    an empty one comes back.
+
+    :param JIRA jira: The client to fetch the users with.
+    :param str project: Key of the project.
+    :param int page_size: Number of users to ask for per page.
+    :return list: (account id, display name) of every user.
+    """
+
+    users = []
+    start = 0
+    while True:
+        page = jira.search_assignable_users_for_projects('', project, startAt=start, maxResults=page_size)
+        if not page:
+            return users
+        users.extend((user.accountId, user.displayName) for user in page)
+        start += page_size
+
+
+def assign_issue(jira: JIRA, issue_id: str, account_id: str):
+    """
+    Assign an issue to an account. This is a blocking call.
+
+    JIRA.assign_issue searches for the user before assigning the issue, even when
+    given an account ID, so the assignee is set directly instead.
+
+    :param JIRA jira: The client to assign the issue with.
+    :param str issue_id: Key of the issue.
+    :param str account_id: Atlassian account ID of the assignee.
+    :return: None
+    """
+
+    url = jira._get_latest_url(f'issue/{issue_id}/assignee')
+    jira._session.put(url, data=json.dumps({'accountId': account_id}))
@@ -0,0 +1,156 @@
+import asyncio
+import os
+from discord.ext.pages import Paginator
+
+PAGINATOR_PREFETCH = int(os.getenv('PAGINATOR_PREFETCH', 5))
+
+
+class LazyPaginator(Paginator):
+    """
+    Paginator that loads its pages from a paginated API as the user flips through them.
+
+    Pages are loaded a batch at a time with the fetch_batch coroutine, which
+    gets a batch number (starting at 0) and the number of pages loaded before
+    the batch, and returns the Pages in it, e.g. one page of GitHub results
+    rendered as one Page per item. Only the first batch is loaded before the
+    paginator is shown. When the user gets within PAGINATOR_PREFETCH pages of
+    the end of what's loaded, the next batch is loaded in the background, so
+    it's usually ready before it's needed. Prefetches call fetch_batch with
+    background=True, so they can be run at a lower priority than loads the
+    user is waiting on.
+
+    Every batch but the last one has batch_size pages, so the total number of
+    pages isn't known until a shorter (or empty) batch comes back, which may be
+    the first one. Until then the "next" button stays enabled, the "last"
+    button is disabled and the page indicator shows the pages loaded so far
+    with a "+".
+
+    Use LazyPaginator.load() to create one, since py-cord's Paginator can't be
+    created without pages.
+
+    Methods
+    --------
+    load(fetch_batch, batch_size, prefetch, **kwargs): LazyPaginator
+        Load the first batch of pages and create a paginator showing them.
+
+    goto_page(page_number, interaction):
+        Show a page, loading its batch first if it isn't loaded yet.
+    """
+
+    def __init__(self, fetch_batch, first_batch, batch_size: int, prefetch: int = PAGINATOR_PREFETCH, **kwargs):
+        super().__init__(pages=list(first_batch), **kwargs)
+        self.fetch_batch = fetch_batch
+        self.prefetch = prefetch
+        self.batch_size = batch_size
+        self.batches_loaded = 1
+        self.exhausted = len(first_batch) < batch_size
+        self._load_lock = asyncio.Lock()
+        self._prefetch_task = None
+        self._update_page_count()
+
+    @classmethod
+    async def load(cls, fetch_batch, batch_size: int, prefetch: int = PAGINATOR_PREFETCH, **kwargs):
+        """
+        Load the first batch of pages and create a paginator showing them.
+
+        :param fetch_batch: Coroutine that loads a batch of pages.
+        :param int batch_size: Number of pages in a full batch, e.g. the number of items per page of API results.
+        :param int prefetch: How close to the end of the loaded pages the user gets before the next batch is loaded.
+        :return LazyPaginator: The paginator, or None if there are no pages to show.
+        """
+
+        first_batch = await fetch_batch(0, 0, background=False)
+        if not first_batch:
+            return None
+        return cls(fetch_batch, first_batch, batch_size, prefetch, **kwargs)
+
+    async def _load_next(self, background=False):
+        async with self._load_lock:
+            if self.exhausted:
+                return
+            batch = await self.fetch_batch(self.batches_loaded, len(self.pages), background=background)
+            self.batches_loaded += 1
+            # a short batch is the last one
+            if not batch or len(batch) < self.batch_size:
+                self.exhausted = True
+            self.pages.extend(batch)
+            self._update_page_count()
+
+    def _update_page_count(self):
+        # while there may be more pages, count one past the loaded ones so "next" stays enabled
+        self.page_count = max(len(self.pages) - (1 if self.exhausted else 0), 0)
+
+    def _prefetch(self):
+        if self.exhausted or len(self.pages) - self.current_page > self.prefetch:
+            return
+        if self._prefetch_task is None or self._prefetch_task.done():
+            self._prefetch_task = asyncio.create_task(self._prefetch_next())
+
+    async def _prefetch_next(self):
+        try:
+            await self._load_next(background=True)
+        except Exception as ex:
+            # the batch is loaded again when the user gets to it
+            print(f'Could not prefetch pages: {ex}')
+
+    def _update_indicator(self):
+        if self.show_indicator and not self.exhausted:
+            self.buttons['page_indicator']['object'].label = f'{self.current_page + 1}/{len(self.pages)}+'
+
+    def update_buttons(self):
+        """
+        Update the buttons, keeping "next" enabled and "last" disabled while there may be more pages.
+
+        :return dict: The paginator's buttons.
+        """
+
+        buttons = super().update_buttons()
+        if not self.exhausted and 'last' in buttons:
+            buttons['last']['object'].disabled = True
+        self._update_indicator()
+        return buttons
+
+    def get_page_content(self, page):
+        """
+        Get the content of a page.
+
+        Paginator.goto_page sets the page indicator's label after updating the
+        buttons and just before it gets the content of the page it shows, so the
+        label is fixed up here while the number of pages isn't known yet.
+
+        :param page: The page.
+        :return Page: The page's content.
+        """
+
+        self._update_indicator()
+        return super().get_page_content(page)
+
+    async def goto_page(self, page_number: int = 0, *, interaction=None):
+        """
+        Show a page, loading its batch first if it isn't loaded yet.
+
+        :param int page_number: The page to show, starting at 0.
+        :param interaction: The interaction to respond to, if the page was changed with a button.
+        :return: None
+        """
+
+        while page_number >= len(self.pages) and not self.exhausted:
+            await self._load_next()
+        page_number = min(page_number, len(self.pages) - 1)
+        self._update_page_count()
+        # Paginator.goto_page updates the buttons before it moves to the page
+        self.current_page = page_number
+        await super().goto_page(page_number, interaction=interaction)
+        self._prefetch()
+
+    async def respond(self, interaction, *args, **kwargs):
+        """
+        Send the paginator as the response to an interaction and start prefetching.
+
+        :param interaction: The interaction to respond to.
+        :return: The paginator's message.
+        """
+
+        message = await super().respond(interaction, *args, **kwargs)
+        self._prefetch()
+        return message
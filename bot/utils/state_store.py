@@ -0,0 +1,192 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'collabybot.db')
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', 2.0))
+
+_DELETED = object()
+
+
+def _encode_key(key):
+    return json.dumps(list(key) if isinstance(key, tuple) else key)
+
+
+def _decode_key(key):
+    key = json.loads(key)
+    return tuple(key) if isinstance(key, list) else key
+
+
+class StateStore:
+    """
+    SQLite-backed store for CollabyBot's state, written behind the in-memory indexes.
+
+    Everything is kept in one key/value table split into namespaces (one per
+    dict or index). State is read once at startup with load() and served from
+    memory after that, so reads never touch the disk. Writes are buffered in
+    memory, coalesced per key, and written in a single transaction by a
+    background thread every STATE_FLUSH_INTERVAL seconds. The database runs in
+    WAL mode so flushes don't block readers.
+
+    Methods
+    --------
+    load(namespace): dict
+        Read every entry in a namespace.
+
+    put(namespace, key, value):
+        Buffer a write.
+
+    delete(namespace, key):
+        Buffer a deletion.
+
+    flush():
+        Write all buffered changes to the database.
+
+    close():
+        Flush and stop the background writer.
+    """
+
+    def __init__(self, path: str = STATE_DB_PATH, flush_interval: float = STATE_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS state ('
+                           'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                           'PRIMARY KEY (namespace, key))')
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+        self._buffer = {}  # (namespace, encoded key) -> encoded value or _DELETED
+        self._buffer_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._writer = None
+        self.flushes = 0
+        self.rows_written = 0
+
+    def load(self, namespace: str) -> dict:
+        """
+        Read every entry in a namespace.
+
+        :param str namespace: Name of the dict or index.
+        :return dict: Decoded keys mapped to decoded values.
+        """
+
+        with self._db_lock:
+            rows = self._conn.execute('SELECT key, value FROM state WHERE namespace = ?', (namespace,)).fetchall()
+        return {_decode_key(key): json.loads(value) for key, value in rows}
+
+    def put(self, namespace: str, key, value):
+        """
+        Buffer a write. It reaches the database on the next flush.
+
+        :param str namespace: Name of the dict or index.
+        :param key: A string or a tuple of JSON-serializable values.
+        :param value: A JSON-serializable value.
+        :return: None
+        """
+
+        self._buffer_write(namespace, key, json.dumps(value))
+
+    def delete(self, namespace: str, key):
+        """
+        Buffer a deletion. It reaches the database on the next flush.
+
+        :param str namespace: Name of the dict or index.
+        :param key: A string or a tuple of JSON-serializable values.
+        :return: None
+        """
+
+        self._buffer_write(namespace, key, _DELETED)
+
+    def _buffer_write(self, namespace, key, value):
+        with self._buffer_lock:
+            self._buffer[(namespace, _encode_key(key))] = value
+        if self._writer is None and not self._closed:
+            self._writer = threading.Thread(target=self._write_behind, name='state-store', daemon=True)
+            self._writer.start()
+
+    def _write_behind(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered changes to the database in one transaction.
+
+        :return: None
+        """
+
+        with self._buffer_lock:
+            buffer, self._buffer = self._buffer, {}
+        if not buffer:
+            return
+
+        upserts = [(ns, key, value) for (ns, key), value in buffer.items() if value is not _DELETED]
+        deletes = [(ns, key) for (ns, key), value in buffer.items() if value is _DELETED]
+        with self._db_lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)', upserts)
+            self._conn.executemany('DELETE FROM state WHERE namespace = ? AND key = ?', deletes)
+        self.flushes += 1
+        self.rows_written += len(buffer)
+
+    def close(self):
+        """
+        Flush any buffered changes and stop the background writer.
+
+        :return: None
+        """
+
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        if self._writer is not None:
+            self._writer.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        """
+        Get the store's write-behind counters.
+
+        :return dict: Pending buffered writes, flushes and rows written.
+        """
+
+        return {'pending': len(self._buffer), 'flushes': self.flushes, 'rows_written': self.rows_written}
+
+
+class StoredDict(dict):
+    """
+    A dict that is loaded from a StateStore namespace and writes its changes back to it.
+
+    Reads are plain dict reads. Assignments and removals are passed to the store's
+    write-behind buffer.
+    """
+
+    def __init__(self, store: StateStore, namespace: str):
+        super().__init__(store.load(namespace))
+        self._store = store
+        self._namespace = namespace
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._store.put(self._namespace, key, value)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._store.delete(self._namespace, key)
+
+    def pop(self, key, *default):
+        had_key = key in self
+        value = super().pop(key, *default)
+        if had_key:
+            self._store.delete(self._namespace, key)
+        return value
+
+
+state_store = StateStore()
+atexit.register(state_store.close)
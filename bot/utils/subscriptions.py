@@ -0,0 +1,354 @@
+from collections import defaultdict
+
+PUSH = 'push'
+ISSUE = 'issue'
+PULL_REQUEST = 'pull_request'
+ALL_BRANCHES = '*'  # push subscription branch that matches every branch, including ones created later
+
+
+class SubscriptionIndex:
+    """
+    Index of the repositories each guild tracks and the channels subscribed to them.
+
+    A subscription is a (guild, channel, repo, event, branch) entry, where branch
+    is only set for push events and may be ALL_BRANCHES. Channels are stored in sets under
+    repo -> (event, branch), so finding the channels to notify for a webhook is
+    a pair of dict lookups no matter how many guilds track the repo. Reverse
+    indexes from guild to repos and channels, and from channel to subscriptions,
+    keep guild, repo and channel removal proportional to what is being removed.
+
+    If a StateStore is given, the index is loaded from it on creation and every
+    change is written back to it.
+
+    Methods
+    --------
+    add_repo(guild, repo, branches):
+        Start tracking a repository in a guild.
+
+    remove_repo(guild, repo): bool
+        Stop tracking a repository in a guild and drop its subscriptions there.
+
+    has_repo(guild, repo): bool
+        Check if a guild tracks a repository.
+
+    guild_repos(guild): list
+        Get the repositories a guild tracks.
+
+    repos(): list
+        Get every repository tracked by at least one guild.
+
+    branches(repo): set
+        Get the known branches of a repository.
+
+    add_branch(repo, branch):
+        Record a new branch of a repository.
+
+    remove_branch(repo, branch):
+        Forget a deleted branch and the subscriptions to it.
+
+    set_branches(repo, branches):
+        Replace the known branches of a repository.
+
+    subscribe(guild, channel, repo, event, branch): bool
+        Subscribe a channel to an event.
+
+    unsubscribe(channel, repo, event): bool
+        Remove a channel's subscriptions to an event.
+
+    channels(repo, event, branch): set
+        Get the channels subscribed to an event.
+
+    remove_guild(guild): set
+        Forget everything about a guild.
+    """
+
+    def __init__(self, store=None):
+        self._store = None
+        self._guild_repos = defaultdict(set)  # guild -> repos
+        self._repo_guilds = defaultdict(set)  # repo -> guilds tracking it
+        self._branches = {}  # repo -> branches
+        self._routes = {}  # repo -> (event, branch) -> channels
+        self._channel_subs = defaultdict(set)  # channel -> (repo, event, branch)
+        self._channel_guild = {}  # channel -> guild
+        self._guild_channels = defaultdict(set)  # guild -> channels with subscriptions
+        if store is not None:
+            self._restore(store)
+        self._store = store
+
+    def _restore(self, store):
+        branches = store.load('repo_branches')
+        for guild, repo in store.load('guild_repos'):
+            self.add_repo(guild, repo, branches.get(repo, []))
+        for guild, channel, repo, event, branch in store.load('subscriptions'):
+            self.subscribe(guild, channel, repo, event, branch)
+
+    def add_repo(self, guild: str, repo: str, branches):
+        """
+        Start tracking a repository in a guild.
+
+        :param str guild: ID of the guild.
+        :param str repo: Full name of the repository.
+        :param branches: Names of the repository's branches.
+        :return: None
+        """
+
+        self._guild_repos[guild].add(repo)
+        self._repo_guilds[repo].add(guild)
+        self._branches[repo] = set(branches)
+        self._routes.setdefault(repo, {})
+        if self._store is not None:
+            self._store.put('guild_repos', (guild, repo), True)
+        self._save_branches(repo)
+
+    def remove_repo(self, guild: str, repo: str) -> bool:
+        """
+        Stop tracking a repository in a guild.
+
+        Subscriptions of the guild's channels to the repository are removed. The
+        repository itself is forgotten once no guild tracks it anymore.
+
+        :param str guild: ID of the guild.
+        :param str repo: Full name of the repository.
+        :return bool: False if the guild wasn't tracking the repository.
+        """
+
+        repos = self._guild_repos.get(guild)
+        if not repos or repo not in repos:
+            return False
+
+        for channel in list(self._guild_channels.get(guild, ())):
+            for sub in [s for s in self._channel_subs[channel] if s[0] == repo]:
+                self._drop(channel, sub)
+
+        repos.discard(repo)
+        if not repos:
+            del self._guild_repos[guild]
+        guilds = self._repo_guilds[repo]
+        guilds.discard(guild)
+        if not guilds:
+            del self._repo_guilds[repo]
+            self._branches.pop(repo, None)
+            self._routes.pop(repo, None)
+        if self._store is not None:
+            self._store.delete('guild_repos', (guild, repo))
+            if not guilds:
+                self._store.delete('repo_branches', repo)
+        return True
+
+    def has_repo(self, guild: str, repo: str) -> bool:
+        """
+        Check if a guild tracks a repository.
+
+        :param str guild: ID of the guild.
+        :param str repo: Full name of the repository.
+        :return bool: True if the repository has been added to the guild.
+        """
+
+        return repo in self._guild_repos.get(guild, ())
+
+    def guild_repos(self, guild: str) -> list:
+        """
+        Get the repositories a guild tracks.
+
+        :param str guild: ID of the guild.
+        :return list: Full names of the repositories, sorted.
+        """
+
+        return sorted(self._guild_repos.get(guild, ()))
+
+    def repo_guilds(self, repo: str) -> set:
+        """
+        Get the guilds that track a repository.
+
+        :param str repo: Full name of the repository.
+        :return set: IDs of the guilds.
+        """
+
+        return set(self._repo_guilds.get(repo, ()))
+
+    def branches(self, repo: str) -> set:
+        """
+        Get the known branches of a repository.
+
+        :param str repo: Full name of the repository.
+        :return set: Branch names.
+        """
+
+        return self._branches.get(repo, set())
+
+    def repos(self) -> list:
+        """
+        Get every repository tracked by at least one guild.
+
+        :return list: Full names of the repositories.
+        """
+
+        return list(self._repo_guilds)
+
+    def add_branch(self, repo: str, branch: str):
+        """
+        Record a new branch of a tracked repository.
+
+        :param str repo: Full name of the repository.
+        :param str branch: Name of the branch.
+        :return: None
+        """
+
+        branches = self._branches.get(repo)
+        if branches is None or branch in branches:
+            return
+        branches.add(branch)
+        self._save_branches(repo)
+
+    def remove_branch(self, repo: str, branch: str):
+        """
+        Forget a deleted branch of a tracked repository, along with the subscriptions to it.
+
+        :param str repo: Full name of the repository.
+        :param str branch: Name of the branch.
+        :return: None
+        """
+
+        branches = self._branches.get(repo)
+        if branches is None or branch not in branches:
+            return
+        branches.discard(branch)
+        for channel in list(self._routes.get(repo, {}).get((PUSH, branch), ())):
+            self._drop(channel, (repo, PUSH, branch))
+        self._save_branches(repo)
+
+    def set_branches(self, repo: str, branches):
+        """
+        Replace the known branches of a tracked repository.
+
+        Subscriptions to branches that no longer exist are removed.
+
+        :param str repo: Full name of the repository.
+        :param branches: Names of the repository's branches.
+        :return: None
+        """
+
+        if repo not in self._branches:
+            return
+        branches = set(branches)
+        for branch in self._branches[repo] - branches:
+            self.remove_branch(repo, branch)
+        self._branches[repo] = branches
+        self._save_branches(repo)
+
+    def _save_branches(self, repo):
+        if self._store is not None:
+            self._store.put('repo_branches', repo, sorted(self._branches[repo]))
+
+    def subscribe(self, guild: str, channel: str, repo: str, event: str, branch: str = None) -> bool:
+        """
+        Subscribe a channel to an event from a repository.
+
+        :param str guild: ID of the guild the channel belongs to.
+        :param str channel: ID of the channel.
+        :param str repo: Full name of the repository.
+        :param str event: One of PUSH, ISSUE or PULL_REQUEST.
+        :param str branch: Branch to subscribe to, or ALL_BRANCHES. Only used for PUSH.
+        :return bool: False if the channel was already subscribed.
+        """
+
+        if event != PUSH:
+            branch = None
+        sub = (repo, event, branch)
+        if sub in self._channel_subs.get(channel, ()):
+            return False
+
+        self._routes.setdefault(repo, {}).setdefault((event, branch), set()).add(channel)
+        self._channel_subs[channel].add(sub)
+        self._channel_guild[channel] = guild
+        self._guild_channels[guild].add(channel)
+        if self._store is not None:
+            self._store.put('subscriptions', (guild, channel) + sub, True)
+        return True
+
+    def unsubscribe(self, channel: str, repo: str, event: str) -> bool:
+        """
+        Remove a channel's subscriptions to an event from a repository, on every branch.
+
+        :param str channel: ID of the channel.
+        :param str repo: Full name of the repository.
+        :param str event: One of PUSH, ISSUE or PULL_REQUEST.
+        :return bool: False if the channel wasn't subscribed.
+        """
+
+        subs = [s for s in self._channel_subs.get(channel, ()) if s[0] == repo and s[1] == event]
+        for sub in subs:
+            self._drop(channel, sub)
+        return bool(subs)
+
+    def channels(self, repo: str, event: str, branch: str = None) -> set:
+        """
+        Get the channels subscribed to an event from a repository.
+
+        :param str repo: Full name of the repository.
+        :param str event: One of PUSH, ISSUE or PULL_REQUEST.
+        :param str branch: Branch the event happened on, only used for PUSH.
+        :return set: IDs of the subscribed channels.
+        """
+
+        routes = self._routes.get(repo)
+        if routes is None:
+            return set()
+        if event != PUSH:
+            return routes.get((event, None), set())
+        channels = routes.get((PUSH, branch), set())
+        everywhere = routes.get((PUSH, ALL_BRANCHES))
+        return channels | everywhere if everywhere else channels
+
+    def remove_guild(self, guild: str) -> set:
+        """
+        Forget every repository and subscription of a guild.
+
+        :param str guild: ID of the guild.
+        :return set: Repositories the guild was tracking.
+        """
+
+        repos = set(self._guild_repos.get(guild, ()))
+        for repo in repos:
+            self.remove_repo(guild, repo)
+        for channel in list(self._guild_channels.get(guild, ())):
+            for sub in list(self._channel_subs.get(channel, ())):
+                self._drop(channel, sub)
+        self._guild_channels.pop(guild, None)
+        return repos
+
+    def _drop(self, channel, sub):
+        repo, event, branch = sub
+        if self._store is not None:
+            self._store.delete('subscriptions', (self._channel_guild.get(channel), channel) + sub)
+        routes = self._routes.get(repo, {})
+        subscribed = routes.get((event, branch))
+        if subscribed is not None:
+            subscribed.discard(channel)
+            if not subscribed:
+                del routes[(event, branch)]
+
+        subs = self._channel_subs[channel]
+        subs.discard(sub)
+        if not subs:
+            del self._channel_subs[channel]
+            guild = self._channel_guild.pop(channel, None)
+            channels = self._guild_channels.get(guild)
+            if channels is not None:
+                channels.discard(channel)
+                if not channels:
+                    del self._guild_channels[guild]
+
+    def stats(self) -> dict:
+        """
+        Get the size of the index.
+
+        :return dict: Number of guilds, repositories, channels and subscriptions.
+        """
+
+        return {
+            'guilds': len(self._guild_repos),
+            'repos': len(self._repo_guilds),
+            'channels': len(self._channel_subs),
+            'subscriptions': sum(len(subs) for subs in self._channel_subs.values()),
+        }
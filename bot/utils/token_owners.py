@@ -0,0 +1,116 @@
+from collections import defaultdict
+
+
+class TokenOwnerIndex:
+    """
+    Index of the users who own a token and the guilds they use it in.
+
+    Users are linked to a guild when they authenticate or run a command there,
+    so when the bot leaves a guild the tokens to clean up are found without
+    going through the guild's members. A user's token is only dropped once
+    they aren't linked to any guild anymore.
+
+    If a StateStore is given, the index is loaded from the namespace on
+    creation and every change is written back to it.
+
+    Methods
+    --------
+    link(guild, user):
+        Record that a user owns a token used in a guild.
+
+    remove_guild(guild): set
+        Forget a guild and get the users left without a guild.
+
+    remove_user(user):
+        Forget a user.
+
+    guild_users(guild): set
+        Get the token owners linked to a guild.
+
+    stats(): dict
+        Get the size of the index.
+    """
+
+    def __init__(self, store=None, namespace: str = None):
+        self._store = store
+        self._namespace = namespace
+        self._guild_users = defaultdict(set)  # guild -> users
+        self._user_guilds = defaultdict(set)  # user -> guilds
+        if store is not None:
+            for guild, user in store.load(namespace):
+                self._guild_users[guild].add(user)
+                self._user_guilds[user].add(guild)
+
+    def link(self, guild: str, user: str):
+        """
+        Record that a user owns a token used in a guild.
+
+        :param str guild: ID of the guild.
+        :param str user: ID of the user.
+        :return: None
+        """
+
+        if guild in self._user_guilds.get(user, ()):
+            return
+        self._guild_users[guild].add(user)
+        self._user_guilds[user].add(guild)
+        if self._store is not None:
+            self._store.put(self._namespace, (guild, user), True)
+
+    def remove_guild(self, guild: str) -> set:
+        """
+        Forget a guild.
+
+        :param str guild: ID of the guild.
+        :return set: IDs of the users that were linked to the guild and to no other guild.
+        """
+
+        orphaned = set()
+        for user in self._guild_users.pop(guild, ()):
+            guilds = self._user_guilds[user]
+            guilds.discard(guild)
+            if not guilds:
+                del self._user_guilds[user]
+                orphaned.add(user)
+            if self._store is not None:
+                self._store.delete(self._namespace, (guild, user))
+        return orphaned
+
+    def remove_user(self, user: str):
+        """
+        Forget a user, in every guild.
+
+        :param str user: ID of the user.
+        :return: None
+        """
+
+        for guild in self._user_guilds.pop(user, ()):
+            users = self._guild_users[guild]
+            users.discard(user)
+            if not users:
+                del self._guild_users[guild]
+            if self._store is not None:
+                self._store.delete(self._namespace, (guild, user))
+
+    def guild_users(self, guild: str) -> set:
+        """
+        Get the token owners linked to a guild.
+
+        :param str guild: ID of the guild.
+        :return set: IDs of the users.
+        """
+
+        return set(self._guild_users.get(guild, ()))
+
+    def stats(self) -> dict:
+        """
+        Get the size of the index.
+
+        :return dict: Number of guilds, users and links.
+        """
+
+        return {
+            'guilds': len(self._guild_users),
+            'users': len(self._user_guilds),
+            'links': sum(len(users) for users in self._guild_users.values()),
+        }